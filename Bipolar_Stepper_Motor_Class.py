@@ -1,60 +1,162 @@
-import RPi.GPIO as GPIO
 import time
 
+import GPIO_Backend
+
 #sequence for a1, b2, a2, b1
 #phase_seq=[[1,1,0,0],[0,1,1,0],[0,0,1,1],[1,0,0,1]];
 #full step sequence. maximum torque
-phase_seq=[[1,0,0,0],[1,1,0,0],[0,1,0,0],[0,1,1,0],[0,0,1,0],[0,0,1,1],[0,0,0,1],[1,0,0,1]]
-#half-step sequence. double resolution. But the torque of the stepper motor is not constant 
+phase_seq=[(1,0,0,0),(1,1,0,0),(0,1,0,0),(0,1,1,0),(0,0,1,0),(0,0,1,1),(0,0,0,1),(1,0,0,1)]
+#half-step sequence. double resolution. But the torque of the stepper motor is not constant
 num_phase=len(phase_seq);
 
+#drive sequences, as steps through phase_seq. Positions and phases are always counted in half steps
+#'half': every phase, half step resolution
+#'full': the phases with both coils on (odd), full steps with maximum torque
+#'wave': the phases with one coil on (even), full steps with half the current
+drive_step={'half':1,'full':2,'wave':2};     #half steps taken by one step of the drive
+drive_parity={'half':None,'full':1,'wave':0};   #phase%2 the drive holds, None for any
+
+class Pin_Bank:
+#Collects the pin writes of one or more motors and applies them in a single GPIO.output call.
+#GPIO.output takes a list of channels and a list of values, so a whole phase transition
+#(or the transitions of every motor stepping on the same tick) costs one call instead of
+#one call per pin, and the coils switch closer together.
+
+    pins=[];
+    levels=[];
+    gpio=None;
+
+    def __init__(self,gpio=None):
+    #[gpio] is the GPIO backend, the one from GPIO_Backend.get_backend() by default
+        if gpio is None:
+            gpio=GPIO_Backend.get_backend();
+        self.gpio=gpio;
+        self.pins=[];
+        self.levels=[];
+
+    def stage(self,pins,levels):
+    #queue [levels] for [pins], nothing is written until commit
+        self.pins.extend(pins);
+        self.levels.extend(levels);
+
+    def commit(self):
+    #write everything that was staged
+        if self.pins:
+            self.gpio.output(self.pins,self.levels);
+            self.pins=[];
+            self.levels=[];
+
+def pin_changes(pins,old,new):
+#(pins, levels) of the [pins] whose level differs between [old] and [new]
+    changed=[k for k in range(len(pins)) if old[k]!=new[k]];
+    return (tuple(pins[k] for k in changed),tuple(new[k] for k in changed));
+
 class Bipolar_Stepper_Motor:
-    
+
     phase=0;
     dirction=0;
     position=0;
-    
+
     a1=0;#pin numbers
     a2=0;
     b1=0;
     b2=0;
-    def __init__(self,a1,a2,b1,b2):
+    pins=(0,0,0,0);#pin numbers in the order of phase_seq: a1, b2, a2, b1
+    levels=None;#shadow register, the levels last written to the pins, None until they are known
+    step_table={};#half steps moved (+-1, +-2) -> for every phase, the (pins, levels) that change on a step from it
+    drive='half';#drive sequence, see drive_step
+    step_size=1;#half steps taken by one step of the drive
+    bank=None;
+    gpio=None;
+    def __init__(self,a1,a2,b1,b2,bank=None,gpio=None,drive='half'):
     #initial a Bipolar_Stepper_Moter objects by assigning the pins
-    
-        GPIO.setmode(GPIO.BCM);
-        
+    #motors that step together can share one Pin_Bank [bank], so their writes go out in one call
+    #[gpio] is the GPIO backend, the one from GPIO_Backend.get_backend() by default
+    #[drive] is the drive sequence the motor starts with, see drive_step
+
+        if gpio is None:
+            gpio=GPIO_Backend.get_backend();
+        self.gpio=gpio;
+
+        gpio.setmode(gpio.BCM);
+
         self.a1=a1;
         self.a2=a2;
         self.b1=b1;
         self.b2=b2;
-        
-        GPIO.setup(self.a1,GPIO.OUT);
-        GPIO.setup(self.a2,GPIO.OUT);
-        GPIO.setup(self.b1,GPIO.OUT);
-        GPIO.setup(self.b2,GPIO.OUT);
-        
+        self.pins=(a1,b2,a2,b1);
+
+        gpio.setup(self.a1,gpio.OUT);
+        gpio.setup(self.a2,gpio.OUT);
+        gpio.setup(self.b1,gpio.OUT);
+        gpio.setup(self.b2,gpio.OUT);
+
+        if bank is None:
+            bank=Pin_Bank(gpio);
+        self.bank=bank;
+
         self.phase=0;
-        self.dirction=0;        
+        self.dirction=0;
         self.position=0;
-        
+        self.levels=None;
+        self.set_drive(drive);
+
+        #only the pins that differ between the phase before and after a step are written,
+        #in the half step sequence that is a single pin
+        self.step_table={};
+        for offset in (1,-1,2,-2):
+            self.step_table[offset]=[pin_changes(self.pins,phase_seq[phase],phase_seq[(phase+offset) % num_phase])
+                                     for phase in range(num_phase)];
+
+    def set_drive(self,drive):
+    #step with the drive sequence [drive] from now on, the position is kept
+    #returns False if the motor sits on a phase [drive] does not hold, the next step then lands
+    #on the wrong kind of phase. Take a half step first to get onto one (see Motor_control.Motor_Step_Drive)
+        self.drive=drive;
+        self.step_size=drive_step[drive];
+        return self.aligned(drive);
+
+    def aligned(self,drive):
+    #True if the current phase is one that [drive] holds
+        parity=drive_parity[drive];
+        return parity is None or self.phase%2==parity;
+
+    def changes(self,levels):
+    #(pins, levels) of the pins that have to be written to get from the shadow register to [levels]
+        if self.levels is None:
+            return (self.pins,tuple(levels));
+        return pin_changes(self.pins,self.levels,levels);
+
+    def stage(self, direction):
+    #advance one step of the drive in [direction] and stage the new phase in the pin bank
+    #the pins change once the bank is committed
+        offset=direction*self.step_size;
+        next_phase=(self.phase+offset) % num_phase;
+
+        if self.levels is phase_seq[self.phase] and offset in self.step_table:
+            [pins,levels]=self.step_table[offset][self.phase];   #the usual case, the coils hold the current phase
+        else:
+            [pins,levels]=self.changes(phase_seq[next_phase]);
+        if pins:
+            self.bank.stage(pins,levels);
+        self.levels=phase_seq[next_phase];
+
+        self.phase=next_phase;
+        self.dirction=direction;
+        self.position+=offset;
+
     def move(self, direction, steps, delay=0.2):
         for _ in range(steps):
-            next_phase=(self.phase+direction) % num_phase;
-            
-            GPIO.output(self.a1,phase_seq[next_phase][0]);
-            GPIO.output(self.b2,phase_seq[next_phase][1]);
-            GPIO.output(self.a2,phase_seq[next_phase][2]);
-            GPIO.output(self.b1,phase_seq[next_phase][3]);
-            
-            self.phase=next_phase;
-            self.direction=dirction;
-            self.position+=dirction;
-            
-            time.sleep(delay);
+            self.stage(direction);
+            self.bank.commit();
+
+            if delay>0:   #callers that time the steps themselves pass delay=0
+                time.sleep(delay);
 
     def unhold(self):
-        GPIO.output(self.a1,0);
-        GPIO.output(self.a2,0);
-        GPIO.output(self.b1,0);
-        GPIO.output(self.b2,0);
-        
+        [pins,levels]=self.changes((0,0,0,0));
+        if pins:
+            self.bank.stage(pins,levels);
+            self.bank.commit();
+        self.levels=(0,0,0,0);
+
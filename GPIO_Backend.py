@@ -0,0 +1,104 @@
+#Pluggable GPIO backend
+#The motor classes and executors do not import RPi.GPIO themselves, they ask this module for
+#the backend to use. A backend is anything with the part of the RPi.GPIO interface we need:
+#setmode, setup, output (single channel or list of channels), cleanup and the BCM/BOARD/OUT
+#constants. On the Pi that is RPi.GPIO itself; off the Pi Simulated_GPIO records every pin
+#transition against a Virtual_Clock, so whole jobs run in milliseconds with exact step timing.
+
+_backend=None;
+
+def get_backend():
+#return the backend in use, RPi.GPIO unless set_backend was called first
+    global _backend
+    if _backend is None:
+        import RPi.GPIO as GPIO
+        _backend=GPIO;
+    return _backend;
+
+def set_backend(backend):
+#use [backend] for every motor created from now on
+    global _backend
+    _backend=backend;
+    return backend;
+
+
+class Virtual_Clock:
+#Stands in for time.perf_counter and time.sleep. Time only moves when somebody sleeps,
+#so a simulated job takes as long as its Python code, not as long as the move
+
+    now=0.0;
+
+    def __init__(self,start=0.0):
+        self.now=start;
+
+    def __call__(self):
+        return self.now;
+
+    def sleep(self,delay):
+        if delay>0:
+            self.now+=delay;
+
+    def scheduler(self):
+    #Step_Scheduler running on this clock. Spinning is switched off, sleep lands exactly on the deadline
+        from Step_Scheduler import Step_Scheduler
+        return Step_Scheduler(spin_time=0.0,clock=self,sleep=self.sleep);
+
+
+class Simulated_GPIO:
+#GPIO backend that drives no hardware, it records (time, pin, level) for every pin that changes
+
+    BCM=11;
+    BOARD=10;
+    OUT=0;
+    IN=1;
+
+    def __init__(self,clock=None,output_time=0.0):
+    #[output_time] (sec) is added to the clock on every output call to model the cost of a GPIO write
+        if clock is None:
+            clock=Virtual_Clock();
+        self.clock=clock;
+        self.output_time=output_time;
+
+        self.mode=None;
+        self.levels={};        #current level of every pin set up as output
+        self.transitions=[];   #(time, pin, level)
+        self.writes=0;         #number of output calls
+
+    def setmode(self,mode):
+        self.mode=mode;
+
+    def setup(self,pin,direction,initial=0):
+        if direction==self.OUT:
+            self.levels[pin]=int(bool(initial));
+
+    def output(self,pins,levels):
+        if not isinstance(pins,(list,tuple)):
+            pins=[pins];
+            levels=[levels];
+        elif not isinstance(levels,(list,tuple)):
+            levels=[levels]*len(pins);
+
+        t=self.clock();
+        for pin,level in zip(pins,levels):
+            if pin not in self.levels:
+                raise RuntimeError('The GPIO channel has not been set up as an OUTPUT');
+            level=int(bool(level));
+            if self.levels[pin]!=level:
+                self.levels[pin]=level;
+                self.transitions.append((t,pin,level));
+
+        self.writes+=1;
+        self.clock.sleep(self.output_time);
+
+    def cleanup(self):
+        self.levels={};
+        self.mode=None;
+
+    def edge_times(self,pins):
+    #times at which any of [pins] changed, one entry per write. For a motor's four pins these are its step times
+        pins=set(pins);
+        times=[];
+        for t,pin,level in self.transitions:
+            if pin in pins and (not times or times[-1]!=t):
+                times.append(t);
+        return times;
@@ -0,0 +1,255 @@
+import re
+from array import array
+
+#G code compiler
+#A single pass tokenizer and modal state machine that turns G code text into compact command
+#records. Every record holds an opcode, the absolute target (X, Y, Z), the arc centre offset
+#(I, J), the feed (F) and the laser power (S) in force. Targets and feeds are always in mm, and
+#the motion mode, G20/G21 and G90/G91 are resolved here, so the executor only has to act on records.
+#Until the first S word the power is not set, records then have None for S and the laser runs at
+#full power, like a laser that has no power control at all.
+#
+#G07 is a raster scanline: 'G07 X10 Y20 I0.5 R4 R2 R6' burns a line along X from (10,20) in steps of
+#I mm (negative I goes towards -X), the R words are run lengths in pixels, on and off in turn starting
+#with on. The runs of every G07 go into the program's runs array, the record points to them.
+#
+#Words may come in any order and case, with or without spaces: 'G00 X1 Y2', 'g1x1y2' and a
+#bare 'X1 Y2' that carries on the last motion mode all compile to the same thing.
+
+RAPID=0;        #G00
+LINEAR=1;       #G01
+ARC_CW=2;       #G02
+ARC_CCW=3;      #G03
+LASER_ON=4;     #M03, M04
+LASER_OFF=5;    #M05
+PROGRAM_END=6;  #M02, M30
+RASTER=7;       #G07
+
+no_power=float('nan');   #S as stored in a program before any S word, read back as None
+
+opcode_names=['G00','G01','G02','G03','M03','M05','M02','G07'];
+
+word_pattern=re.compile(r'([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))');
+comment_pattern=re.compile(r'\([^)]*\)|;.*');
+simple_move_pattern=re.compile(r'\s*(?:G(0?[0-3])\s*)?X([-+]?(?:\d+\.?\d*|\.\d+))\s*Y([-+]?(?:\d+\.?\d*|\.\d+))\s*$');
+motion_words={'0':RAPID,'00':RAPID,'1':LINEAR,'01':LINEAR,'2':ARC_CW,'02':ARC_CW,'3':ARC_CCW,'03':ARC_CCW};
+
+class Gcode_Program:
+#Array backed list of command records. The opcode and source line of each record sit in two
+#integer arrays, its seven values (x, y, z, i, j, f, s) next to each other in one array of doubles
+#the run lengths of raster records are kept in a third array, j of the record is where they start
+
+    stride=7;
+
+    def __init__(self):
+        self.opcode=array('B');
+        self.line=array('L');     #line number in the source, counting from 1
+        self.values=array('d');   #x, y, z, i, j in mm, f in mm/min, s
+        self.runs=array('L');     #for every raster record the number of runs, then the runs
+
+    def append(self,opcode,x,y,z,i,j,f,s,line):
+        self.opcode.append(opcode);
+        self.line.append(line);
+        self.values.extend((x,y,z,i,j,f,s));
+
+    def append_runs(self,runs):
+    #store the run lengths of a raster record, return the offset to put in its j
+        offset=len(self.runs);
+        self.runs.append(len(runs));
+        self.runs.extend(runs);
+        return offset;
+
+    def get_runs(self,offset):
+    #run lengths stored at [offset], the j of a raster record
+        offset=int(offset);
+        return tuple(self.runs[offset+1:offset+1+self.runs[offset]]);
+
+    def clear(self):
+    #drop every record and run, a streamed program is cleared once its records have been queued
+        del self.opcode[:];
+        del self.line[:];
+        del self.values[:];
+        del self.runs[:];
+
+    def __len__(self):
+        return len(self.opcode);
+
+    def __getitem__(self,k):
+    #record [k] as a tuple (opcode, x, y, z, i, j, f, s, line), s is None when no S word has been given
+        if k<0:
+            k+=len(self.opcode);
+        n=k*7;
+        s=self.values[n+6];
+        if s!=s:   #no_power
+            s=None;
+        return (self.opcode[k],)+tuple(self.values[n:n+6])+(s,self.line[k]);
+
+    def __iter__(self):
+        for k in range(len(self.opcode)):
+            yield self[k];
+
+
+class Gcode_Compiler:
+#Modal state that is carried from one line to the next
+
+    motion=RAPID;
+    absolute=True;      #G90 / G91
+    scale=1.0;          #1 for G21 (mm), 25.4 for G20 (inch)
+    x=0.0;              #current position, mm
+    y=0.0;
+    z=0.0;
+    feed=0.0;           #mm/min
+    power=no_power;     #S in force, no_power until the first S word
+    line_number=0;
+
+    def __init__(self):
+        self.motion=RAPID;
+        self.absolute=True;
+        self.scale=1.0;
+        self.x=0.0;
+        self.y=0.0;
+        self.z=0.0;
+        self.feed=0.0;
+        self.power=no_power;
+        self.line_number=0;
+
+    def compile_line(self,text,program):
+    #compile one line of G code into [program], return the number of records added
+        self.line_number+=1;
+        text=text.upper();
+
+        simple=simple_move_pattern.match(text);
+        if simple is not None and self.absolute:   #the usual 'G1 X.. Y..' line, no need to go through the words
+            [motion,x,y]=simple.groups();
+            if motion is not None:
+                self.motion=motion_words[motion];
+            self.x=float(x)*self.scale;
+            self.y=float(y)*self.scale;
+            program.opcode.append(self.motion);
+            program.line.append(self.line_number);
+            program.values.extend((self.x,self.y,self.z,0.0,0.0,self.feed,self.power));
+            return 1;
+
+        if '(' in text or ';' in text:
+            text=comment_pattern.sub('',text);
+
+        words=word_pattern.findall(text);
+        if not words:
+            return 0;
+
+        motion=None;
+        feed=None;
+        mcodes=[];
+        axes={};
+        raster=False;
+        runs=[];
+        for letter,value in words:
+            if letter in 'XYZIJ':
+                axes[letter]=float(value);
+            elif letter=='R':
+                runs.append(int(float(value)));
+            elif letter=='G':
+                if value in motion_words:
+                    motion=motion_words[value];
+                    continue;
+                code=float(value);
+                if code<=3 and code==int(code):
+                    motion=int(code);
+                elif code==7:
+                    raster=True;   #not modal, only this line is a scanline
+                elif code==20:
+                    self.scale=25.4;
+                elif code==21:
+                    self.scale=1.0;
+                elif code==90:
+                    self.absolute=True;
+                elif code==91:
+                    self.absolute=False;
+            elif letter=='M':
+                mcodes.append(int(float(value)));
+            elif letter=='F':
+                feed=float(value);   #scaled below, G20/G21 may come later on the same line
+            elif letter=='S':
+                self.power=float(value);
+
+        if motion is not None:
+            self.motion=motion;
+        if feed is not None:
+            self.feed=feed*self.scale;
+
+        count=0;
+        for m in mcodes:   #spindle/laser on takes effect before the move on the same line
+            if m==3 or m==4:
+                program.append(LASER_ON,self.x,self.y,self.z,0.0,0.0,self.feed,self.power,self.line_number);
+                count+=1;
+
+        if raster:
+            scale=self.scale;
+            if self.absolute:
+                x=axes['X']*scale if 'X' in axes else self.x;
+                y=axes['Y']*scale if 'Y' in axes else self.y;
+            else:
+                x=self.x+axes.get('X',0.0)*scale;
+                y=self.y+axes.get('Y',0.0)*scale;
+            pixel=axes.get('I',0.0)*scale;
+            offset=program.append_runs(runs);
+            program.append(RASTER,x,y,self.z,pixel,offset,self.feed,self.power,self.line_number);
+            self.x=x+pixel*sum(runs);   #the scanline ends after its last run
+            self.y=y;
+            count+=1;
+
+        elif axes and (self.motion>=ARC_CW or ('X' in axes) or ('Y' in axes) or ('Z' in axes)):
+            scale=self.scale;
+            if self.absolute:
+                x=axes['X']*scale if 'X' in axes else self.x;
+                y=axes['Y']*scale if 'Y' in axes else self.y;
+                z=axes['Z']*scale if 'Z' in axes else self.z;
+            else:
+                x=self.x+axes.get('X',0.0)*scale;
+                y=self.y+axes.get('Y',0.0)*scale;
+                z=self.z+axes.get('Z',0.0)*scale;
+            program.opcode.append(self.motion);
+            program.line.append(self.line_number);
+            program.values.extend((x,y,z,axes.get('I',0.0)*scale,axes.get('J',0.0)*scale,self.feed,self.power));
+            self.x=x;
+            self.y=y;
+            self.z=z;
+            count+=1;
+
+        if not mcodes:
+            return count;
+        for m in mcodes:   #laser off and end of program take effect after the move
+            if m==5:
+                program.append(LASER_OFF,self.x,self.y,self.z,0.0,0.0,self.feed,self.power,self.line_number);
+                count+=1;
+            elif m==2 or m==30:
+                program.append(PROGRAM_END,self.x,self.y,self.z,0.0,0.0,self.feed,self.power,self.line_number);
+                count+=1;
+        return count;
+
+    def compile_lines(self,lines,program=None):
+    #compile every line of the iterable [lines], return the Gcode_Program
+        if program is None:
+            program=Gcode_Program();
+        for text in lines:
+            self.compile_line(text,program);
+        return program;
+
+
+def raster_edges(x,pixel,runs):
+#X positions (mm) where the laser switches along a raster record that starts at [x] with pixels of [pixel] mm
+    edges=[x];
+    for run in runs:
+        x+=pixel*run;
+        edges.append(x);
+    return edges;
+
+
+def compile_file(filename):
+#compile the G code file [filename] into a Gcode_Program
+    gcode=open(filename,'r');
+    try:
+        program=Gcode_Compiler().compile_lines(gcode);
+    finally:
+        gcode.close();
+    return program;
@@ -0,0 +1,204 @@
+from math import sqrt
+
+import Motor_control
+import Gcode_Compiler
+
+#G code execution shared by SPi_Interface_V1, Job_Estimator and Step_Stream
+#A Record_Runner turns compiled G code records into moves queued in a Motion_Planner, a
+#Segment_Runner runs the planned segments on the motors with the Motor_control step loops.
+#The two only meet through the planner's execute callback, so they can sit in different
+#processes with a Segment_Ring in between. Everything they act on (motors, planner, scheduler,
+#laser, machine parameters) is handed in, nothing is global.
+
+class Segment_Runner:
+#Runs planned segments on the motors [MX], [MY], [MZ], timed by [scheduler]
+
+    rapid_drive='full';   #drive sequence of rapid moves, engraving is always half steps
+
+    def __init__(self,MX,MY,MZ,scheduler,laser=None,rapid_drive='full',timing=None):
+    #[laser] is a Laser_Control.Laser, [timing] a Step_Timing.Timing_Log, both may be left out
+        self.MX=MX;
+        self.MY=MY;
+        self.MZ=MZ;
+        self.scheduler=scheduler;
+        self.laser=laser;
+        self.rapid_drive=rapid_drive;
+        self.timing=timing;
+
+    def run(self,segment):
+    #Run one planned segment, speeds are handed over from the planner so there is no stop at the junctions
+    #has the signature of the planner's execute callback
+        scheduler=self.scheduler;
+        laser=self.laser;
+        if self.timing is not None:
+            self.timing.begin_move(segment.line,segment.length,segment.nominal_speed,segment.duration(),scheduler.clock());
+        if laser is not None:
+            #the laser switches, and takes the power of the segment, on its first step
+            laser.begin(segment.laser,segment.power,segment.nominal_speed,segment.runs);
+
+        if segment.center is None:
+            #Z only joins the timing loop when it moves
+            if segment.stepz:
+                [motors,steps]=[[self.MX,self.MY,self.MZ],[segment.stepx,segment.stepy,segment.stepz]];
+            else:
+                [motors,steps]=[[self.MX,self.MY],[segment.stepx,segment.stepy]];
+            #rapids are stepped with rapid_drive, with full steps the same step rate covers twice the distance
+            drive=self.rapid_drive if not segment.engraving else 'half';
+            Motor_control.Motor_Step_Drive(motors,steps,drive,
+                                           segment.entry_speed,segment.nominal_speed,segment.exit_speed,
+                                           segment.acceleration,scheduler,laser);
+        else:
+            #arcs are stepped around the centre rounded to the nearest step
+            xc=int(round(segment.center[0]));
+            yc=int(round(segment.center[1]));
+            [xs,ys]=segment.start;
+            Motor_control.Motor_Step_Arc(self.MX,self.MY,xs-xc,ys-yc,xs+segment.stepx-xc,ys+segment.stepy-yc,
+                                         segment.clockwise,segment.length,
+                                         segment.entry_speed,segment.nominal_speed,segment.exit_speed,
+                                         segment.acceleration,scheduler,laser);
+
+        if self.timing is not None:
+            self.timing.end_move(scheduler.clock());
+        return 0;
+
+
+class Record_Runner:
+#Queues the moves of compiled G code records in [planner]
+#Positions in the records are in mm, the compiler has already dealt with G20/G21 and G90/G91
+
+    dx=0.075;             #resolution of X, Y and Z, mm
+    dy=0.075;
+    dz=0.075;
+    speed=0.0;            #engraving speed when the G code gives no F, steps/sec
+    rapid_speed=50;       #fast movement step rate, steps/sec
+    rapid_drive='full';
+    chord_tolerance=0.01; #mm, how far the planner's sub-arcs may stray from the circle
+    overlap_z=True;       #a Z only rapid that retracts runs together with the rapid after it
+    verbose=False;        #print every move and laser change
+
+    x_pos=0.0;            #last programmed position, mm
+    y_pos=0.0;
+    z_pos=0.0;
+    retract=False;        #a retract is being held back
+
+    def __init__(self,planner,program,dx,dy,dz,speed,rapid_speed,rapid_drive='full',chord_tolerance=0.01,
+                 overlap_z=True,verbose=False):
+    #[program] is the Gcode_Program the records come from, it holds the runs of raster records
+        self.planner=planner;
+        self.program=program;
+        self.dx=dx;
+        self.dy=dy;
+        self.dz=dz;
+        self.speed=speed;
+        self.rapid_speed=rapid_speed;
+        self.rapid_drive=rapid_drive;
+        self.chord_tolerance=chord_tolerance;
+        self.overlap_z=overlap_z;
+        self.verbose=verbose;
+
+        self.x_pos=0.0;
+        self.y_pos=0.0;
+        self.z_pos=0.0;
+        self.retract=False;
+
+    def moveto(self,x_pos,y_pos,speed,engraving,z_pos=None):
+    #Queue a move to (x_pos,y_pos,z_pos) (in real unit) in the motion planner, Z stays where it is when [z_pos] is None
+    #the planner keeps track of where the queued moves end, so the steps are taken from there
+        planner=self.planner;
+        stepx=int(round(x_pos/self.dx))-planner.position[0];
+        stepy=int(round(y_pos/self.dy))-planner.position[1];
+        stepz=0;
+        if z_pos is not None:
+            stepz=int(round(z_pos/self.dz))-planner.position[2];
+
+        if sqrt(stepx**2+stepy**2+stepz**2)>0:
+            if not engraving: #fast movement
+                if self.verbose:
+                    print('No Laser, fast movement: Dx=%d  Dy=%d  Dz=%d'%(stepx,stepy,stepz));
+                planner.add_segment(stepx,stepy,self.rapid_speed*Motor_control.drive_step[self.rapid_drive],False,stepz);
+            else:
+                if self.verbose:
+                    print('Laser on, movement: Dx=%d  Dy=%d  Dz=%d'%(stepx,stepy,stepz));
+                planner.add_segment(stepx,stepy,speed,True,stepz);
+        return 0;
+
+    def execute(self,record):
+    #Queue one compiled command record. Returns False once the end of the program (M02) is reached
+        planner=self.planner;
+        [opcode,x,y,z,i_pos,j_pos,f,s,line]=record;
+        planner.line=line;   #segments queued from here on come from this line
+        planner.power=s;     #and carry the laser power in force
+
+        if f>0:
+            cut_speed=f/60.0/min(self.dx,self.dy);   #F is in mm/min
+        else:
+            cut_speed=self.speed;
+
+        #the retract is only joined with a rapid that stays up, anything else would cancel the lift
+        if self.retract and (opcode!=Gcode_Compiler.RAPID or z<self.z_pos):   #run it on its own
+            self.moveto(self.x_pos,self.y_pos,self.speed,False,self.z_pos);
+            self.retract=False;
+
+        if opcode==Gcode_Compiler.PROGRAM_END:
+            planner.laser=False;
+            if self.verbose:
+                print('finished. shuting down');
+            return False;
+
+        #the laser state goes with the segments queued after it, the step loops switch it without a stop
+        elif opcode==Gcode_Compiler.LASER_OFF:
+            planner.laser=False;
+            if self.verbose:
+                print('Laser turned off');
+
+        elif opcode==Gcode_Compiler.LASER_ON:
+            planner.laser=True;
+            if self.verbose:
+                print('Laser turned on');
+
+        elif opcode==Gcode_Compiler.RAPID or opcode==Gcode_Compiler.LINEAR:
+            engraving=(opcode==Gcode_Compiler.LINEAR);
+            if self.overlap_z and opcode==Gcode_Compiler.RAPID and x==self.x_pos and y==self.y_pos and z>self.z_pos:
+                #a retract (Z only, going up) is held back, the next rapid lifts and travels in one move
+                self.retract=True;
+            else:
+                self.moveto(x,y,cut_speed,engraving,z);
+                self.retract=False;
+            self.x_pos=x;
+            self.y_pos=y;
+            self.z_pos=z;
+
+        elif opcode==Gcode_Compiler.ARC_CW or opcode==Gcode_Compiler.ARC_CCW: #circular interpolation
+            xcenter=self.x_pos+i_pos;   #center of the circle for interpolation
+            ycenter=self.y_pos+j_pos;
+            self.x_pos=x;
+            self.y_pos=y;
+
+            #the planner splits the arc by the chord tolerance, the steps follow the circle itself
+            planner.add_arc(int(round(x/self.dx)),int(round(y/self.dy)),(xcenter/self.dx,ycenter/self.dy),
+                            opcode==Gcode_Compiler.ARC_CW,cut_speed,True,self.chord_tolerance/min(self.dx,self.dy));
+
+        elif opcode==Gcode_Compiler.RASTER: #scanline, one constant speed move with the laser switched along it
+            runs=self.program.get_runs(j_pos);
+            edges=[int(round(e/self.dx)) for e in Gcode_Compiler.raster_edges(x,i_pos,runs)];
+            if len(runs)>0 and edges[-1]!=edges[0]:
+                direction=1 if edges[-1]>edges[0] else -1;
+                #rapid to the start of the lead-in, the planner adds the lead-in, the scanline and the lead-out
+                lead_in=planner.raster_leads(edges,cut_speed)[0];
+                self.moveto((edges[0]-direction*lead_in)*self.dx,y,self.speed,False,self.z_pos);
+                planner.add_raster(edges,cut_speed);
+            self.x_pos=x+i_pos*sum(runs);
+            self.y_pos=y;
+
+        return True;
+
+    def finish(self,return_home=True):
+    #end of the job: laser off, and back to the origin with [return_home], a retract that is still held back runs first
+        self.planner.laser=False;
+        if return_home:
+            self.planner.line=0;
+            self.moveto(0,0,self.speed,False,self.z_pos);
+        elif self.retract:
+            self.moveto(self.x_pos,self.y_pos,self.speed,False,self.z_pos);
+        self.retract=False;
+        return 0;
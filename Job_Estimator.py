@@ -0,0 +1,252 @@
+import sys
+import time
+import heapq
+
+import Gcode_Compiler
+import Gcode_Executor
+from Laser_Control import fires
+from Motion_Planner import Motion_Planner
+from GPIO_Backend import Virtual_Clock
+from Bipolar_Stepper_Motor_Class import drive_step, drive_parity, num_phase
+
+#Offline job estimator
+#Runs a G code file the way SPi_Interface_V1 does (same compiler, planner and Motor_control step
+#loops, same machine parameters) without any GPIO. The motors are replaced by step counters and
+#the steps are timed on a Virtual_Clock, so the estimate is the exact time the step loops would
+#take on the machine, and a job of hours is worked out in seconds.
+#
+#usage: python Job_Estimator.py file.nc [file.nc ...]
+
+class Step_Counter:
+#Stands in for a Bipolar_Stepper_Motor in the Motor_control step loops. It counts the steps
+#and keeps the shortest time between two of them, it is its own pin bank
+
+    position=0;          #half steps
+    phase=0;
+    drive='half';
+    step_size=1;
+    steps=0;             #steps taken in either direction, a full step counts once
+    last_step=None;      #clock time of the last step
+    min_interval=None;   #shortest time between two steps, sec
+
+    def __init__(self,clock):
+        self.clock=clock;
+        self.bank=self;
+        self.pending=0;
+
+        self.phase=0;
+        self.set_drive('half');
+        self.position=0;
+        self.steps=0;
+        self.last_step=None;
+        self.min_interval=None;
+
+    def set_drive(self,drive):
+        self.drive=drive;
+        self.step_size=drive_step[drive];
+        return self.aligned(drive);
+
+    def aligned(self,drive):
+        parity=drive_parity[drive];
+        return parity is None or self.phase%2==parity;
+
+    def stage(self,direction):
+        self.pending=direction*self.step_size;
+        self.phase=(self.phase+self.pending) % num_phase;
+
+    def commit(self):
+    #the step happens when the bank is committed, after the scheduler has waited for its deadline
+        if self.pending:
+            now=self.clock();
+            if self.last_step is not None:
+                interval=now-self.last_step;
+                if interval>0 and (self.min_interval is None or interval<self.min_interval):
+                    self.min_interval=interval;
+            self.last_step=now;
+            self.position+=self.pending;
+            self.steps+=1;
+            self.pending=0;
+
+    def peak_rate(self):
+    #highest step rate, steps/sec
+        if not self.min_interval:
+            return 0.0;
+        return 1.0/self.min_interval;
+
+    def unhold(self):
+        pass;
+
+
+class Job_Report:
+
+    total_time=0.0;     #sec, machine time of the whole job
+    rapid_time=0.0;     #sec spent on moves with the laser off
+    cut_time=0.0;       #sec spent on moves with the laser on
+    laser_time=0.0;     #sec the laser was switched on (M03) while moving
+    steps=(0,0,0);      #steps taken by X, Y and Z
+    peak_rate=(0.0,0.0,0.0);   #highest step rate of X, Y and Z, steps/sec
+    segments=0;         #planner segments executed
+    records=0;          #compiled G code records
+    longest=[];         #(duration, line, engraving, stepx, stepy, stepz) of the longest segments, longest first
+    wall_time=0.0;      #sec it took to work all this out
+
+    def __init__(self):
+        self.longest=[];
+
+    def summary(self):
+        text=[];
+        text.append('machine time  %s (rapid %s, cut %s)'%(format_time(self.total_time),
+                                                          format_time(self.rapid_time),format_time(self.cut_time)));
+        text.append('laser on      %s'%format_time(self.laser_time));
+        text.append('steps         X %d, Y %d, Z %d'%self.steps);
+        text.append('peak rate     X %.1f, Y %.1f, Z %.1f steps/s'%self.peak_rate);
+        text.append('records       %d, segments %d'%(self.records,self.segments));
+        for [duration,line,engraving,stepx,stepy,stepz] in self.longest:
+            text.append('  %10s  line %-6d %s  Dx=%d Dy=%d Dz=%d'%(format_time(duration),line,
+                                                                 'cut  ' if engraving else 'rapid',stepx,stepy,stepz));
+        if self.wall_time>0:
+            text.append('estimated in  %.3f s (%.0fx faster than real time)'%(self.wall_time,self.total_time/self.wall_time));
+        return '\n'.join(text);
+
+
+def format_time(t):
+#[t] sec as h:mm:ss.s
+    t=round(t,1);
+    [h,t]=divmod(t,3600.0);
+    [m,t]=divmod(t,60.0);
+    return '%d:%02d:%04.1f'%(h,m,t);
+
+
+class Job_Estimator:
+#Machine parameters, the defaults are the ones in SPi_Interface_V1
+
+    dx=0.075;                 #resolution in x direction. Unit: mm
+    dy=0.075;                 #resolution in y direction. Unit: mm
+    dz=0.075;                 #resolution in z direction. Unit: mm
+    overlap_z=True;           #a Z only rapid that retracts runs together with the rapid after it
+    feed_rate=0.01;           #engraving speed when the G code gives no F, mm/sec
+    rapid_speed=50;           #fast movement step rate, step/sec
+    rapid_drive='full';       #drive sequence of rapid moves, see Bipolar_Stepper_Motor_Class.drive_step
+    acceleration=2.0;         #mm/sec^2
+    junction_deviation=0.02;  #mm
+    lookahead=16;
+    chord_tolerance=0.01;     #mm
+    raster_lead=10.0;         #mm, longest lead-in and lead-out of a raster scanline
+    x_travel=305.0;           #mm, X travel from the origin, raster leads stay within it
+    longest_count=5;          #number of longest segments kept for the report
+
+    def __init__(self,dx=0.075,dy=0.075,feed_rate=0.01,rapid_speed=50,acceleration=2.0,
+                 junction_deviation=0.02,lookahead=16,chord_tolerance=0.01,longest_count=5,rapid_drive='full',
+                 dz=0.075,overlap_z=True,raster_lead=10.0,x_travel=305.0):
+        self.dx=dx;
+        self.dy=dy;
+        self.dz=dz;
+        self.overlap_z=overlap_z;
+        self.feed_rate=feed_rate;
+        self.rapid_speed=rapid_speed;
+        self.rapid_drive=rapid_drive;
+        self.acceleration=acceleration;
+        self.junction_deviation=junction_deviation;
+        self.lookahead=lookahead;
+        self.chord_tolerance=chord_tolerance;
+        self.longest_count=longest_count;
+        self.raster_lead=raster_lead;
+        self.x_travel=x_travel;
+
+    def estimate(self,lines,return_home=True):
+    #run the G code lines of the iterable [lines] and return a Job_Report
+    #with [return_home] the machine goes back to the origin at the end, like SPi_Interface_V1 does
+        start=time.time();
+        clock=Virtual_Clock();
+        MX=Step_Counter(clock);
+        MY=Step_Counter(clock);
+        MZ=Step_Counter(clock);
+
+        report=self.run(lines,MX,MY,clock,return_home,MZ);
+
+        report.steps=(MX.steps,MY.steps,MZ.steps);
+        report.peak_rate=(MX.peak_rate(),MY.peak_rate(),MZ.peak_rate());
+        report.wall_time=time.time()-start;
+        return report;
+
+    def run(self,lines,MX,MY,clock,return_home=True,MZ=None,laser=None):
+    #run the G code lines of the iterable [lines] on the motors [MX], [MY] and [MZ], timed on the Virtual_Clock [clock]
+    #the motors are anything with stage(direction) and a bank with commit(), a Step_Counter or a Bipolar_Stepper_Motor
+    #Z moves are only counted when [MZ] is left out. [laser], a Laser_Control.Laser, is driven when it is given
+    #returns a Job_Report with the times and the longest segments filled in
+        dx=self.dx;
+        dy=self.dy;
+        dz=self.dz;
+        if MZ is None:
+            MZ=Step_Counter(clock);
+        speed=self.feed_rate/min(dx,dy);
+        scheduler=clock.scheduler();
+        t_start=clock();
+
+        report=Job_Report();
+        longest=[];   #heap of the longest segments, shortest of them first
+        runner=Gcode_Executor.Segment_Runner(MX,MY,MZ,scheduler,laser,self.rapid_drive);
+
+        def execute_segment(segment):
+            t0=clock();
+            runner.run(segment);
+            duration=clock()-t0;
+            #the same rule as the laser itself, and not a raster lead-in or lead-out
+            if fires(segment.laser,segment.power) and (segment.runs is None or len(segment.runs)>0):
+                report.laser_time+=duration;
+
+            if segment.engraving:
+                report.cut_time+=duration;
+            else:
+                report.rapid_time+=duration;
+            report.segments+=1;
+
+            entry=(duration,segment.line,segment.engraving,segment.stepx,segment.stepy,segment.stepz);
+            if len(longest)<self.longest_count:
+                heapq.heappush(longest,entry);
+            elif duration>longest[0][0]:
+                heapq.heapreplace(longest,entry);
+
+        planner=Motion_Planner(execute_segment,self.acceleration/min(dx,dy),
+                               self.junction_deviation/min(dx,dy),self.lookahead,(0,0),
+                               self.raster_lead/dx,(0,int(self.x_travel/dx)));
+
+        compiler=Gcode_Compiler.Gcode_Compiler();
+        program=Gcode_Compiler.Gcode_Program();
+        compiler.compile_lines(lines,program);
+        report.records=len(program);
+
+        #the same Record_Runner as SPi_Interface_V1
+        records=Gcode_Executor.Record_Runner(planner,program,dx,dy,dz,speed,self.rapid_speed,self.rapid_drive,
+                                             self.chord_tolerance,self.overlap_z);
+        for record in program:
+            if not records.execute(record):
+                break;
+        records.finish(return_home);
+        planner.flush();
+        if laser is not None:
+            laser.off();
+
+        report.total_time=clock()-t_start;
+        report.longest=sorted(longest,reverse=True);
+        return report;
+
+    def estimate_file(self,filename,return_home=True):
+    #Job_Report of the G code file [filename]
+        gcode=open(filename,'r');
+        try:
+            report=self.estimate(gcode,return_home);
+        finally:
+            gcode.close();
+        return report;
+
+
+if __name__ == "__main__":
+    if len(sys.argv)<2:
+        print('usage: python Job_Estimator.py file.nc [file.nc ...]');
+        sys.exit(1);
+
+    estimator=Job_Estimator();
+    for filename in sys.argv[1:]:
+        print(filename);
+        print(estimator.estimate_file(filename).summary());
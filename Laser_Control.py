@@ -0,0 +1,115 @@
+import GPIO_Backend
+
+#Laser gating inside the step loops
+#Every planned segment carries the laser state (on or off) and the power (S word) that were in force
+#when it was queued, and the step loops apply them on the first step of the segment. M03, M05 and
+#power changes therefore need no stop, the laser switches where the move it belongs to starts.
+#On a backend with PWM (RPi.GPIO) the duty cycle follows the speed of the move: while the machine
+#speeds up or slows down the power is scaled by speed/nominal speed, so corners and the ends of a
+#cut get the same energy per mm as the rest of it. Without PWM the laser is only switched.
+#A power of None (no S word in the G code so far) is full power.
+#A raster segment carries runs as well, steps the laser is on and off for in turn. The laser then
+#counts the steps of the segment and switches at every run boundary, within the one move.
+
+def fires(on,power):
+#True if a segment with laser state [on] and [power] burns, None is full power
+    return on and (power is None or power>0);
+
+
+class Laser:
+
+    pin=15;               #Laser_switch of the reference executer
+    max_power=1000.0;     #S value for full power
+    frequency=1000;       #PWM frequency, Hz
+    duty_step=1.0;        #duty cycle (%) changes smaller than this are not written
+
+    on=False;             #state of the segment being run
+    power=0.0;
+    nominal_speed=0.0;    #speed the power is meant for, steps/sec
+    speed_scale=1;        #half steps per step of the loop that calls update (2 for full step drives)
+    duty=0.0;             #duty cycle (%) last written
+    edges=None;           #raster segments: step count at the end of every run
+    edge=0;               #run the laser is in
+    tick=0;               #steps of the segment so far
+
+    def __init__(self,pin=15,gpio=None,max_power=1000.0,frequency=1000):
+    #[gpio] is the GPIO backend, the one from GPIO_Backend.get_backend() by default
+        if gpio is None:
+            gpio=GPIO_Backend.get_backend();
+        self.gpio=gpio;
+        self.pin=pin;
+        self.max_power=float(max_power);
+        self.frequency=frequency;
+
+        gpio.setup(pin,gpio.OUT);
+        gpio.output(pin,0);
+        self.pwm=None;
+        if hasattr(gpio,'PWM'):
+            self.pwm=gpio.PWM(pin,frequency);
+            self.pwm.start(0);
+
+        self.on=False;
+        self.power=0.0;
+        self.nominal_speed=0.0;
+        self.speed_scale=1;
+        self.duty=0.0;
+        self.edges=None;
+        self.edge=0;
+        self.tick=0;
+
+    def begin(self,on,power,nominal_speed,runs=None):
+    #state for the move that is about to start, it is applied by the first update
+    #[runs] are the on and off runs (steps) of a raster segment, None for a move that is on or off all along.
+    #The first run of a raster segment is applied straight away, it covers the first step
+        self.on=fires(on,power);
+        if power is None:
+            self.power=1.0;
+        else:
+            self.power=min(power/self.max_power,1.0);
+        self.nominal_speed=nominal_speed;
+        self.edges=None;
+        if runs is not None:
+            edges=[];
+            total=0;
+            for run in runs:
+                total+=run;
+                edges.append(total);
+            self.edges=edges;
+            self.edge=0;
+            self.tick=0;
+            self.switch(nominal_speed);   #the first run starts before the first step
+
+    def update(self,speed):
+    #called by the step loops after every step, [speed] is the speed of that step in steps/sec
+        if self.edges is not None:
+            self.tick+=1;
+        self.switch(speed);
+
+    def switch(self,speed):
+    #write the duty cycle for the step the machine is at
+        on=self.on;
+        edges=self.edges;
+        if edges is not None:
+            while self.edge<len(edges) and self.tick>=edges[self.edge]:
+                self.edge+=1;
+            on=on and self.edge%2==0 and self.edge<len(edges);   #even runs are the on runs
+
+        if not on:
+            duty=0.0;
+        elif self.pwm is None or self.nominal_speed<=0:
+            duty=100.0;
+        else:
+            duty=100.0*self.power*min(speed*self.speed_scale/self.nominal_speed,1.0);
+            duty=round(duty/self.duty_step)*self.duty_step;
+
+        if duty!=self.duty:
+            self.duty=duty;
+            if self.pwm is not None:
+                self.pwm.ChangeDutyCycle(duty);
+            else:
+                self.gpio.output(self.pin,1 if duty>0 else 0);
+
+    def off(self):
+        self.on=False;
+        self.edges=None;
+        self.update(0.0);
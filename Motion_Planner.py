@@ -0,0 +1,302 @@
+from math import sqrt, atan2, cos, sin, acos, pi, ceil
+
+#Lookahead motion planner
+#Segments are queued instead of being executed one by one from standstill to standstill.
+#For every junction the planner works out how fast the machine may pass the corner, then a
+#reverse and a forward pass over the buffer make sure every segment can reach its exit speed
+#with the given acceleration. Segments leave the buffer with an (entry, nominal, exit) speed
+#triple, which is a trapezoidal velocity profile.
+#
+#Arcs are queued as a number of sub-arcs. The chord tolerance decides how many: the chord of
+#every sub-arc stays within the tolerance of the circle, so the planner's view of the path is
+#that accurate. The steps of a sub-arc still follow the circle itself (Motor_control.Arc_Ticks).
+#
+#A raster scanline is queued as one segment along X that carries the runs the laser is on and off
+#for. A lead-in before it and a lead-out after it, with the laser off, are long enough to reach
+#and leave the engraving speed, so the whole scanline runs at constant speed. The leads are no
+#longer than max_lead and stay within the X travel, where they are cut short the ends of the
+#scanline speed up and slow down (the laser power follows the speed).
+#
+#All units are steps: lengths in steps, speeds in steps/sec, acceleration in steps/sec^2
+#Lines may move the Z axis as well, lengths and directions are then taken in three dimensions.
+#Arcs are in the XY plane
+
+class Planner_Segment:
+
+    stepx=0;  #relative move of the segment
+    stepy=0;
+    stepz=0;
+    start=(0,0);     #absolute XY position the segment starts from
+    length=0.0;
+    unit=(0.0,0.0,0.0);  #direction of travel at the start
+    exit_unit=(0.0,0.0,0.0);  #direction of travel at the end, differs from unit for arcs
+
+    center=None;     #absolute centre of the circle for arcs, None for straight lines
+    clockwise=False;
+
+    nominal_speed=0.0;    #speed asked for by the G code
+    max_entry_speed=0.0;  #junction limit with the previous segment
+    entry_speed=0.0;      #planned speeds
+    exit_speed=0.0;
+    acceleration=0.0;
+    engraving=False;
+    locked=False;         #entry speed is fixed, the previous segment has already been executed
+    line=0;               #line of G code the segment comes from, 0 if unknown
+    laser=False;          #laser on during the segment
+    power=0.0;            #laser power (S) during the segment, None for full power
+    runs=None;            #raster segments: steps the laser is on and off for in turn, starting with on
+
+    def __init__(self,stepx,stepy,speed,acceleration,engraving=False,stepz=0):
+        self.stepx=stepx;
+        self.stepy=stepy;
+        self.stepz=stepz;
+        self.length=sqrt(stepx**2+stepy**2+stepz**2);
+        self.unit=(stepx/self.length,stepy/self.length,stepz/self.length);
+        self.exit_unit=self.unit;
+        self.start=(0,0);
+        self.center=None;
+        self.clockwise=False;
+        self.nominal_speed=float(speed);
+        self.acceleration=float(acceleration);
+        self.engraving=engraving;
+
+        self.max_entry_speed=0.0;
+        self.entry_speed=0.0;
+        self.exit_speed=0.0;
+        self.locked=False;
+        self.line=0;
+        self.laser=False;
+        self.power=0.0;
+        self.runs=None;
+
+    def trapezoid(self):
+    #return the distances (in steps) spent accelerating, cruising and decelerating
+        a=self.acceleration;
+        v_entry=self.entry_speed;
+        v_exit=self.exit_speed;
+        v_nominal=self.nominal_speed;
+
+        accelerate=(v_nominal**2-v_entry**2)/(2.0*a);
+        decelerate=(v_nominal**2-v_exit**2)/(2.0*a);
+
+        if accelerate+decelerate>self.length:
+            #nominal speed is never reached, the profile is a triangle
+            accelerate=(2.0*a*self.length+v_exit**2-v_entry**2)/(4.0*a);
+            accelerate=min(max(accelerate,0.0),self.length);
+            return accelerate,0.0,self.length-accelerate;
+
+        return accelerate,self.length-accelerate-decelerate,decelerate;
+
+    def duration(self):
+    #return the time (in sec) the segment takes to run
+        a=self.acceleration;
+        [accelerate,cruise,decelerate]=self.trapezoid();
+        v_peak=sqrt(self.entry_speed**2+2.0*a*accelerate);
+
+        t=(v_peak-self.entry_speed)/a+(v_peak-self.exit_speed)/a;
+        if cruise>0:
+            t+=cruise/v_peak;
+        return t;
+
+
+class Motion_Planner:
+
+    acceleration=0.0;        #steps/sec^2
+    junction_deviation=0.0;  #steps, how far the path may stray from a sharp corner
+    lookahead=16;            #number of segments kept in the buffer
+    position=[0,0,0];        #X, Y, Z position in steps once every queued segment has run
+    line=0;                  #line of G code handed to the segments queued from now on
+    laser=False;             #laser state and power handed to the segments queued from now on
+    power=0.0;
+    max_lead=None;           #steps, longest raster lead-in and lead-out, None for no limit
+    x_limits=None;           #(min,max) X travel in steps, raster leads stay within it. None for no limit
+
+    def __init__(self,execute,acceleration,junction_deviation,lookahead=16,position=(0,0),max_lead=None,x_limits=None):
+    #[execute] is called with every planned Planner_Segment, oldest first
+
+        self.execute=execute;
+        self.acceleration=float(acceleration);
+        self.junction_deviation=float(junction_deviation);
+        self.lookahead=lookahead;
+        self.position=[position[0],position[1],position[2] if len(position)>2 else 0];
+        self.line=0;
+        self.laser=False;
+        self.power=0.0;
+        self.max_lead=max_lead;
+        self.x_limits=x_limits;
+
+        self.buffer=[];
+        self.previous_unit=None;      #direction of the last segment that was added
+        self.previous_speed=0.0;
+
+    def junction_speed(self,unit,speed):
+    #maximum speed through the corner between the last queued segment and a new one along [unit]
+        if self.previous_unit is None:
+            return 0.0;
+
+        #cosine of the angle between the two segments, 1 means a full reversal
+        cos_theta=-(self.previous_unit[0]*unit[0]+self.previous_unit[1]*unit[1]+self.previous_unit[2]*unit[2]);
+        v_max=min(speed,self.previous_speed);
+
+        if cos_theta<=-0.999999:   #straight line, no need to slow down
+            return v_max;
+        if cos_theta>=0.999999:    #reversal, come to a full stop
+            return 0.0;
+
+        sin_theta_d2=sqrt(0.5*(1.0-cos_theta));
+        v_junction=sqrt(self.acceleration*self.junction_deviation*sin_theta_d2/(1.0-sin_theta_d2));
+        return min(v_junction,v_max);
+
+    def add_segment(self,stepx,stepy,speed,engraving=False,stepz=0):
+    #queue a relative move of [stepx],[stepy],[stepz] steps at [speed] steps/sec
+        if stepx==0 and stepy==0 and stepz==0:
+            return 0;
+
+        segment=Planner_Segment(stepx,stepy,speed,self.acceleration,engraving,stepz);
+        return self.queue(segment);
+
+    def add_arc(self,x_step,y_step,center,clockwise,speed,engraving=True,chord_tolerance=0.5):
+    #queue an arc to the absolute position ([x_step],[y_step]) around [center] (absolute, in steps)
+    #the arc is split so the chord of every sub-arc is within [chord_tolerance] steps of the circle
+        [cx,cy]=center;
+        [x0,y0]=self.position[0:2];
+        r=sqrt((x0-cx)**2+(y0-cy)**2);
+        if r==0:
+            return self.moveto(x_step,y_step,speed,engraving);
+
+        d=-1 if clockwise else 1;
+        a0=atan2(y0-cy,x0-cx);
+        theta=(d*(atan2(y_step-cy,x_step-cx)-a0)) % (2.0*pi);   #angle spanned by the arc
+        if theta<1e-9:
+            theta=2.0*pi;                #start and end are the same point, full circle
+
+        if chord_tolerance<r:
+            no_segment=int(ceil(theta/(2.0*acos(1.0-chord_tolerance/r))));
+        else:
+            no_segment=int(ceil(theta/(pi/2.0)));
+        no_segment=max(no_segment,1);
+
+        #a point moving on a circle of radius r is limited by the centripetal acceleration
+        speed=min(speed,sqrt(self.acceleration*r));
+
+        for k in range(1,no_segment+1):
+            if k==no_segment:
+                [x1,y1]=[x_step,y_step];
+            else:
+                a=a0+d*k*theta/no_segment;
+                [x1,y1]=[int(round(cx+r*cos(a))),int(round(cy+r*sin(a)))];
+
+            [xs,ys]=self.position[0:2];
+            if x1==xs and y1==ys:
+                continue;
+
+            segment=Planner_Segment(x1-xs,y1-ys,speed,self.acceleration,engraving);
+            segment.center=(cx,cy);
+            segment.clockwise=clockwise;
+            segment.length=r*theta/no_segment;
+            #travel direction is along the tangent at both ends
+            segment.unit=(-d*(ys-cy)/r,d*(xs-cx)/r,0.0);
+            segment.exit_unit=(-d*(y1-cy)/r,d*(x1-cx)/r,0.0);
+            self.queue(segment);
+        return 0;
+
+    def raster_lead(self,speed):
+    #length (steps) of the lead-in and lead-out of a raster scanline at [speed], at most max_lead
+        lead=int(ceil(speed**2/(2.0*self.acceleration)));
+        if self.max_lead is not None:
+            lead=min(lead,int(self.max_lead));
+        return lead;
+
+    def raster_leads(self,edges,speed):
+    #lengths (steps) of the lead-in and lead-out of the raster scanline [edges], cut short at the X travel limits
+        direction=1 if edges[-1]>=edges[0] else -1;
+        lead_in=lead_out=self.raster_lead(speed);
+        if self.x_limits is not None:
+            [x_min,x_max]=self.x_limits;
+            if direction>0:
+                [room_in,room_out]=[edges[0]-x_min,x_max-edges[-1]];
+            else:
+                [room_in,room_out]=[x_max-edges[0],edges[-1]-x_min];
+            lead_in=max(min(lead_in,room_in),0);
+            lead_out=max(min(lead_out,room_out),0);
+        return lead_in,lead_out;
+
+    def add_raster(self,edges,speed,engraving=True):
+    #queue a raster scanline along X at the current Y, [edges] are the absolute X positions (steps) where
+    #the laser switches, on at the first one. It should start raster_leads(edges,speed)[0] steps before edges[0]
+        direction=1 if edges[-1]>=edges[0] else -1;
+        lead_out=self.raster_leads(edges,speed)[1];
+        runs=tuple(abs(edges[k+1]-edges[k]) for k in range(len(edges)-1));
+
+        for [stepx,segment_runs] in [(edges[0]-self.position[0],()),(edges[-1]-edges[0],runs),(direction*lead_out,())]:
+            if stepx==0:
+                continue;
+            segment=Planner_Segment(stepx,0,speed,self.acceleration,engraving);
+            segment.runs=segment_runs;
+            self.queue(segment);
+        return 0;
+
+    def queue(self,segment):
+    #add a Planner_Segment that starts where the queued moves end
+        segment.start=(self.position[0],self.position[1]);
+        segment.line=self.line;
+        segment.laser=self.laser and segment.engraving;   #rapids never burn
+        segment.power=self.power;
+        segment.max_entry_speed=self.junction_speed(segment.unit,segment.nominal_speed);
+
+        self.buffer.append(segment);
+        self.previous_unit=segment.exit_unit;
+        self.previous_speed=segment.nominal_speed;
+
+        self.position[0]+=segment.stepx;
+        self.position[1]+=segment.stepy;
+        self.position[2]+=segment.stepz;
+
+        self.recalculate();
+
+        while len(self.buffer)>self.lookahead:
+            self.pop();
+        return 0;
+
+    def moveto(self,x_step,y_step,speed,engraving=False,z_step=None):
+    #queue a move to the absolute position ([x_step],[y_step],[z_step]), Z stays where it is when [z_step] is None
+        if z_step is None:
+            z_step=self.position[2];
+        return self.add_segment(x_step-self.position[0],y_step-self.position[1],speed,engraving,z_step-self.position[2]);
+
+    def recalculate(self):
+        a=self.acceleration;
+        buffer=self.buffer;
+
+        #reverse pass: the last segment has to be able to stop, every segment has to be able
+        #to slow down to the entry speed of the one after it
+        next_entry=0.0;
+        for segment in reversed(buffer):
+            if not segment.locked:
+                segment.entry_speed=min(segment.max_entry_speed,sqrt(next_entry**2+2.0*a*segment.length));
+            next_entry=segment.entry_speed;
+
+        #forward pass: no segment may be entered faster than the one before it can accelerate to
+        for k in range(len(buffer)-1):
+            reachable=sqrt(buffer[k].entry_speed**2+2.0*a*buffer[k].length);
+            if buffer[k+1].entry_speed>reachable:
+                buffer[k+1].entry_speed=reachable;
+
+        for k in range(len(buffer)-1):
+            buffer[k].exit_speed=buffer[k+1].entry_speed;
+        buffer[-1].exit_speed=0.0;
+
+    def pop(self):
+    #hand the oldest segment to the executor
+        segment=self.buffer.pop(0);
+        if self.buffer:
+            self.buffer[0].locked=True;
+        self.execute(segment);
+        return segment;
+
+    def flush(self):
+    #run everything that is still queued, the machine comes to a stop at the end
+        while self.buffer:
+            self.pop();
+        self.previous_unit=None;
+        return 0;
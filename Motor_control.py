@@ -1,7 +1,6 @@
-import RPi.GPIO as GPIO
-import time
-from Bipolar_Stepper_Motor_Class import Bipolar_Stepper_Motor
 from numpy import abs,sqrt
+from Step_Scheduler import Step_Scheduler
+from Bipolar_Stepper_Motor_Class import drive_step
 
 
 def GCD(a,b):#greatest common diviser
@@ -10,7 +9,7 @@ def GCD(a,b):#greatest common diviser
     return a;
 
 def LCM(a,b):#least common multipler
-    return a*b/GCD(a,b);
+    return a*b//GCD(a,b);
 
 def sign(a): #return the sign of number a
     if a>0:
@@ -19,49 +18,274 @@ def sign(a): #return the sign of number a
         return -1;
     else:
         return 0;
-    
-def Motor_Step(stepper1, step1, stepper2, step2, speed):
+
+def DDA_Ticks(steps):
+#   integer DDA (Bresenham) line engine for any number of axes
+#   [steps] is a list of signed step counts, one entry per axis
+#   yields one list per tick of the dominant axis, holding the index of every axis that steps on that tick
+#   the work done is O(max(|steps|)), no matter whether the step counts share a common divisor
+
+    count=[int(abs(s)) for s in steps];
+    num_axis=len(count);
+    total_tick=max(count) if num_axis else 0;
+
+    error=[total_tick//2]*num_axis;  #start every accumulator half way, so the steps are centred on the line
+
+    for _ in range(total_tick):
+        moving=[];
+        for k in range(num_axis):
+            error[k]-=count[k];
+            if error[k]<0:         #axis k has fallen behind the line, step it
+                error[k]+=total_tick;
+                moving.append(k);
+        yield moving;
+
+def Motor_Step(stepper1, step1, stepper2, step2, speed, scheduler=None):
 #   control stepper motor 1 and 2 simultaneously
 #   stepper1 and stepper2 are objects of Bipolar_Stepper_Motor class
 #   direction is reflected in the polarity of [step1] or [step2]
+#   steps are timed by [scheduler] (a Step_Scheduler), pass the same one to every move so the timing
+#   carries on from one move to the next. A new one is made when it is left out
 
     dir1=sign(step1);  #get dirction from the polarity of argument [step]
     dir2=sign(step2);
 
-    step1=abs(step1);
-    step2=abs(step2);
-
-# [total_micro_step] total number of micro steps
-# stepper motor 1 will move one step every [micro_step1] steps
-# stepper motor 2 will move one step every [micro_step2] steps
-# So [total_mirco_step]=[micro_step1]*[step1] if step1<>0;  [total_micro_step]=[micro_step2]*[step2] if step2<>0 
-
-    if step1==0:
-        total_micro_step=step2;
-    	micro_step2=1;
-        micro_step1=step2+100;  #set [micro_step1]>[total_micro_step], so stepper motor will not turn
-    elif step2==0:
-        total_micro_step=step1;
-        micro_step1=1;
-        micro_step2=step1+100;
-    else:
-        total_micro_step=LCM(step1,step2);
-        micro_step1=total_micro_step/step1;
-        micro_step2=total_micro_step/step2;
+    step1=int(abs(step1));
+    step2=int(abs(step2));
+
+# [total_tick] is the number of steps of the dominant axis
+# every tick the dominant motor turns one step, the other one turns whenever DDA_Ticks says so
+    total_tick=max(step1,step2);
+    if total_tick==0:
+        return 0;
 
     T=sqrt(step1**2+step2**2)/speed;      #total time
-    dt=T/total_micro_step;                #time delay every micro_step
-    
-    for i in range(1,total_micro_step+1):    #i is the iterator for the micro_step. i cannot start from 0
-        time_laps=0;
-        if ((i % micro_step1)==0):#motor 1 need to turn one step
-            stepper1.move(dir1,1,dt/4.0);
-            time_laps+=dt/4.0;
-            
-        if ((i % micro_step2)==0):#motor 2 need to turn one step
-            stepper2.move(dir2,1,dt/4.0);
-            time_laps+=dt/4.0;
-        
-        time.sleep(dt-time_laps);
+    dt=T/total_tick;                      #time between ticks
+
+    if scheduler is None:
+        scheduler=Step_Scheduler();
+    scheduler.resume();
+
+    for moving in DDA_Ticks([step1,step2]):
+        if 0 in moving:#motor 1 need to turn one step
+            stepper1.stage(dir1);
+
+        if 1 in moving:#motor 2 need to turn one step
+            stepper2.stage(dir2);
+
+        scheduler.wait(dt);
+        stepper1.bank.commit();  #one write for the motors that share a pin bank
+        stepper2.bank.commit();
+
+    return 0;
+
+def Profile_Speed(s, length, entry_speed, nominal_speed, exit_speed, acceleration):
+#   speed (steps/sec) at distance [s] along a move of [length] steps with a trapezoidal velocity profile
+    v_accelerate=sqrt(entry_speed**2+2.0*acceleration*s);
+    v_decelerate=sqrt(exit_speed**2+2.0*acceleration*max(length-s,0.0));
+    return min(nominal_speed,v_accelerate,v_decelerate);
+
+def Motor_Step_Profile(stepper1, step1, stepper2, step2, entry_speed, nominal_speed, exit_speed, acceleration, scheduler=None, laser=None):
+#   same as Motor_Step, but the speed follows a trapezoidal profile
+#   the move is entered at [entry_speed], accelerates up to [nominal_speed] and leaves at [exit_speed]
+#   speeds are in steps/sec along the path, [acceleration] in steps/sec^2
+#   [laser] (a Laser_Control.Laser) is updated with the speed after every step
+    return Motor_Step_Axes([stepper1,stepper2],[step1,step2],entry_speed,nominal_speed,exit_speed,acceleration,scheduler,laser);
+
+def Motor_Step_Axes(steppers, steps, entry_speed, nominal_speed, exit_speed, acceleration, scheduler=None, laser=None):
+#   Motor_Step_Profile for any number of motors, [steppers] and [steps] have one entry per axis
+#   every motor steps in the same timing loop, so a Z move runs together with the X and Y moves
+#   the path length, and so the speed, is taken over all axes
+
+    dirs=[sign(step) for step in steps];
+    count=[int(abs(step)) for step in steps];
+
+    total_tick=max(count) if count else 0;
+    if total_tick==0:
+        return 0;
+
+    length=sqrt(sum(n*n for n in count));
+    ds=length/total_tick;                 #distance along the path every tick
+    s=-ds/2.0;                            #speed is taken in the middle of each tick
+
+    banks=[];                             #every pin bank once, motors that share one are written together
+    for stepper in steppers:
+        if not any(stepper.bank is bank for bank in banks):
+            banks.append(stepper.bank);
+
+    if scheduler is None:
+        scheduler=Step_Scheduler();
+    scheduler.resume();
+
+    for moving in DDA_Ticks(count):
+        s+=ds;
+        for k in moving:
+            steppers[k].stage(dirs[k]);
+
+        v=Profile_Speed(s,length,entry_speed,nominal_speed,exit_speed,acceleration);
+        scheduler.wait(ds/v);
+        for bank in banks:
+            bank.commit();
+        if laser is not None:
+            laser.update(v);
+
+    return 0;
+
+def Motor_Step_Drive(steppers, steps, drive, entry_speed, nominal_speed, exit_speed, acceleration, scheduler=None, laser=None):
+#   same as Motor_Step_Axes, but the bulk of the move is stepped with the drive sequence [drive]
+#   ('half', 'full' or 'wave', see Bipolar_Stepper_Motor_Class.drive_step). Steps and speeds are in half steps
+#   as everywhere else, a full step drive covers the move with half the number of ticks
+#   a full step drive only holds every other phase, so a motor that sits between two of them first takes a
+#   half step, and a step left over at the end is taken as a half step too
+
+    size=drive_step[drive];
+    if size==1:
+        return Motor_Step_Axes(steppers,steps,entry_speed,nominal_speed,exit_speed,acceleration,scheduler,laser);
+
+    dirs=[sign(step) for step in steps];
+    count=[int(abs(step)) for step in steps];
+
+    length=sqrt(sum(n*n for n in count));
+    if length==0:
+        return 0;
+
+    align=[1 if count[k]>0 and not steppers[k].aligned(drive) else 0 for k in range(len(steppers))];
+    full=[(count[k]-align[k])//size for k in range(len(steppers))];
+    rest=[count[k]-align[k]-size*full[k] for k in range(len(steppers))];
+
+    #(steps of every motor, drive, half steps per step) of the three parts of the move
+    parts=[(align,'half',1),(full,drive,size),(rest,'half',1)];
+
+    drives=[stepper.drive for stepper in steppers];
+    s=0.0;
+    for [part,part_drive,part_size] in parts:
+        if not any(part):
+            continue;
+        part_length=part_size*sqrt(sum(n*n for n in part));
+        #every part carries on the speed profile of the whole move, in its own step units
+        v_start=Profile_Speed(s,length,entry_speed,nominal_speed,exit_speed,acceleration);
+        v_end=Profile_Speed(s+part_length,length,entry_speed,nominal_speed,exit_speed,acceleration);
+        for stepper in steppers:
+            stepper.set_drive(part_drive);
+        if laser is not None:
+            laser.speed_scale=part_size;   #the loop counts in steps of the drive, the laser in half steps
+        Motor_Step_Axes(steppers,[dirs[k]*part[k] for k in range(len(steppers))],
+                        v_start/part_size,nominal_speed/part_size,v_end/part_size,acceleration/part_size,scheduler,laser);
+        s+=part_length;
+
+    for k in range(len(steppers)):
+        steppers[k].set_drive(drives[k]);
+    if laser is not None:
+        laser.speed_scale=1;
+    return 0;
+
+def Quadrant(x,y):
+#   quadrant (0 to 3, counterclockwise) of point (x,y), points on an axis belong to the quadrant they start
+    if x>0 and y>=0:
+        return 0;
+    elif x<=0 and y>0:
+        return 1;
+    elif x<0 and y<=0:
+        return 2;
+    else:
+        return 3;
+
+def Arc_Ticks(x, y, xe, ye, clockwise):
+#   incremental integer circle stepping around the origin
+#   (x,y) is the start and (xe,ye) the end of the arc, relative to the centre of the circle, in steps
+#   yields one (step_x, step_y) pair per tick, each -1, 0 or 1
+#   every tick takes whichever of the x step, y step or diagonal step along the direction of travel keeps
+#   x^2+y^2 closest to the radius^2. The error term is updated by integer additions, there is no trig here
+
+    d=-1 if clockwise else 1;
+    R2=x*x+y*y;
+    F=0;                                  #x^2+y^2-R2 of the current point
+
+    if R2>0:
+        q=Quadrant(x,y);
+        cross=x*ye-y*xe;                  #>0 if the end is ahead of the start (counterclockwise)
+        crossings=(d*(Quadrant(xe,ye)-q)) % 4;  #number of quadrant boundaries to pass
+        if crossings==0 and d*cross<=0:
+            crossings=4;                  #end is behind the start in the same quadrant, or a full circle
+
+        max_tick=16*(abs(x)+abs(y))+16;   #a full circle takes about 8*r ticks
+        for _ in range(max_tick):
+            if crossings<0 or (crossings==0 and d*(x*ye-y*xe)<=0):
+                break;                    #reached or passed the end, the circle may leave its quadrant first
+
+            sx=-d*sign(y);                #direction of travel, the tangent (-y,x) for counterclockwise
+            sy=d*sign(x);
+
+            ex=2*x*sx+1 if sx else 0;     #change of F for a step in x, in y
+            ey=2*y*sy+1 if sy else 0;
+            if sx==0:
+                [mx,my,dF]=[0,sy,ey];
+            elif sy==0:
+                [mx,my,dF]=[sx,0,ex];
+            else:
+                [mx,my,dF]=min([sx,0,ex],[0,sy,ey],[sx,sy,ex+ey],key=lambda c: abs(F+c[2]));
+
+            x+=mx;
+            y+=my;
+            F+=dF;
+
+            qn=Quadrant(x,y);
+            if qn!=q:
+                q=qn;
+                crossings-=1;
+            yield (mx,my);
+
+    #finish with a straight line onto the exact end point, the end need not lie on the integer circle
+    sx=sign(xe-x);
+    sy=sign(ye-y);
+    for moving in DDA_Ticks([xe-x,ye-y]):
+        yield ((sx if 0 in moving else 0),(sy if 1 in moving else 0));
+
+def Motor_Step_Arc(stepper1, stepper2, x, y, xe, ye, clockwise, length, entry_speed, nominal_speed, exit_speed, acceleration, scheduler=None, laser=None):
+#   move stepper motor 1 and 2 along a circular arc with a trapezoidal speed profile
+#   (x,y) and (xe,ye) are the start and end relative to the centre of the circle, in steps
+#   [length] is the length of the arc in steps, the speeds and [laser] are the same as for Motor_Step_Profile
+
+    if scheduler is None:
+        scheduler=Step_Scheduler();
+    scheduler.resume();
+
+    #every tick moves the axis the circle is steeper in by one step,
+    #which is r/max(|x|,|y|) steps along the arc
+    r=sqrt(x*x+y*y);
+    ticks=[];
+    for [mx,my] in Arc_Ticks(x,y,xe,ye,clockwise):
+        ticks.append((mx,my,r/max(abs(x),abs(y),1)));
+        x+=mx;
+        y+=my;
+
+    #the ticks (integer circle and the finishing line) need not add up to [length] exactly,
+    #the profile is followed by the fraction of the ticks done so it ends at [length] and never at a speed of 0
+    if not ticks:
+        return 0;
+    total=sum(tick[2] for tick in ticks);
+    if total==0:                          #start on the centre, only the finishing line is left
+        ticks=[(mx,my,1.0) for [mx,my,ds] in ticks];
+        total=float(len(ticks));
+    if length<=0:
+        length=total;
+    scale=length/total;
+
+    s=0.0;
+    for [mx,my,ds] in ticks:
+        ds*=scale;
+        s+=ds;
+
+        if mx:
+            stepper1.stage(mx);
+        if my:
+            stepper2.stage(my);
+
+        v=Profile_Speed(s-ds/2.0,length,entry_speed,nominal_speed,exit_speed,acceleration);
+        scheduler.wait(ds/v);
+        stepper1.bank.commit();
+        stepper2.bank.commit();
+        if laser is not None:
+            laser.update(v);
 
     return 0;
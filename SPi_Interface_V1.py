@@ -1,15 +1,23 @@
 import sys
 import time
-import RPi.GPIO as GPIO
+import GPIO_Backend
 #import stepper as stepper
 import serial
 import os.path
 import time, datetime
-from numpy import pi, sin, cos, sqrt, arccos, arcsin
+import signal
+import multiprocessing
 
 
-import Motor_control
-from Bipolar_Stepper_Motor_Class import Bipolar_Stepper_Motor
+from Bipolar_Stepper_Motor_Class import Bipolar_Stepper_Motor, Pin_Bank
+from Motion_Planner import Motion_Planner
+from Step_Scheduler import Step_Scheduler
+from Serial_Receiver import Gcode_Receiver
+from Segment_Ring import Segment_Ring, run_executor
+from Step_Timing import Timing_Log
+from Laser_Control import Laser
+import Gcode_Compiler
+from Gcode_Executor import Segment_Runner, Record_Runner
 
 
 ################################################################################################
@@ -20,53 +28,36 @@ from Bipolar_Stepper_Motor_Class import Bipolar_Stepper_Motor
 ################################################################################################
 ################################################################################################
 
-def XYposition(lines):
-    #given a movement command line, return the X Y position
-    xchar_loc=lines.index('X');
-    i=xchar_loc+1;
-    while (47<ord(lines[i])<58)|(lines[i]=='.')|(lines[i]=='-'):
-        i+=1;
-    x_pos=float(lines[xchar_loc+1:i]);    
-    
-    ychar_loc=lines.index('Y');
-    i=ychar_loc+1;
-    while (47<ord(lines[i])<58)|(lines[i]=='.')|(lines[i]=='-'):
-        i+=1;
-    y_pos=float(lines[ychar_loc+1:i]);    
-
-    return x_pos,y_pos;
-
-def IJposition(lines):
-    #given a G02 or G03 movement command line, return the I J position
-    ichar_loc=lines.index('I');
-    i=ichar_loc+1;
-    while (47<ord(lines[i])<58)|(lines[i]=='.')|(lines[i]=='-'):
-        i+=1;
-    i_pos=float(lines[ichar_loc+1:i]);    
-    
-    jchar_loc=lines.index('J');
-    i=jchar_loc+1;
-    while (47<ord(lines[i])<58)|(lines[i]=='.')|(lines[i]=='-'):
-        i+=1;
-    j_pos=float(lines[jchar_loc+1:i]);    
-
-    return i_pos,j_pos;
-
-def moveto(MX,x_pos,dx,MY,y_pos,dy,speed,engraving):
-#Move to (x_pos,y_pos) (in real unit)
-    stepx=int(round(x_pos/dx))-MX.position;
-    stepy=int(round(y_pos/dy))-MY.position;
-
-    Total_step=sqrt((stepx**2+stepy**2));
-    
-    if Total_step>0:
-        if lines[0:3]=='G0 ': #fast movement
-            print 'No Laser, fast movement: Dx=', stepx, '  Dy=', stepy;
-            Motor_control.Motor_Step(MX,stepx,MY,stepy,50);
-        else:
-            print 'Laser on, movement: Dx=', stepx, '  Dy=', stepy;
-            Motor_control.Motor_Step(MX,stepx,MY,stepy,speed);
-    return 0;
+def executor_main():
+#Body of the executor process: run the segments the planner puts in the ring until it is closed
+#Ctrl-C is left to the planner process, which stops reading and sends the machine home through the ring
+    signal.signal(signal.SIGINT,signal.SIG_IGN);
+    laser=Laser(Laser_switch,GPIO,laser_max_power);   #made here, a PWM thread does not survive the fork
+    runner.laser=laser;
+    run_executor(ring,runner.run,executor_cpu,executor_priority);
+    laser.off();
+    print 'Step timing:', scheduler.report();
+    write_timing_report();
+
+def write_timing_report():
+#end of job timing report, next to the G code log
+    if timing is not None:
+        report_name=filename.rsplit('.',1)[0]+' - timing.txt';
+        missed=timing.write_report(report_name,min(dx,dy));
+        print 'Timing report written to', report_name, '(%d missed deadlines)'%missed;
+
+
+def execute_line(lines):
+#Compile one line of G code and run the records it gives. Returns False once the end of the program (M02) is reached
+#the queued segments carry everything they need, runs included, so the records are dropped and memory stays flat
+    compiler.compile_line(lines,program);
+    try:
+        for record in program:
+            if not records.execute(record):
+                return False;
+    finally:
+        program.clear();
+    return True;
 
 
 ################################################################################################
@@ -100,20 +91,71 @@ open(filename, 'a').close()
 
 #filename = './reference_stuff/spiral.nc'
 
+GPIO = GPIO_Backend.get_backend()   # RPi.GPIO, unless a simulated backend was set
 GPIO.setmode(GPIO.BCM)
 
 #Define stepper motors:
-MX = Bipolar_Stepper_Motor(23,22,24,26)
+#both motors share one pin bank, so a tick that steps both of them is a single GPIO write
+bank = Pin_Bank()
+MX = Bipolar_Stepper_Motor(23,22,24,26,bank)
 print("Initialized Motor 1 (X) with pin 5,6,10,12")
-MY = Bipolar_Stepper_Motor(11,7,5,3)
+MY = Bipolar_Stepper_Motor(11,7,5,3,bank)
 print("Initialized Motor 2 (Y) with pin 13,16,20,21")
+MZ = Bipolar_Stepper_Motor(12,16,20,21,bank)
+print("Initialized Motor 3 (Z) with pin 12,16,20,21")
 
 #####################################################
 ## TO BE DETERMINED ONCE MACHANICAL STUFF ARE DOWN ##
 #####################################################
 dx=0.075; #resolution in x direction. Unit: mm
 dy=0.075; #resolution in y direction. Unit: mm
+dz=0.075; #resolution in z direction. Unit: mm
 feed_rate = 0.01
+speed=feed_rate/min(dx,dy);   #engraving speed, step/sec
+rapid_speed=50;               #fast movement step rate, step/sec
+rapid_drive='full';           #drive sequence of rapid moves: 'full' (high torque), 'wave' or 'half'. Engraving is always half steps
+overlap_z=True;               #a Z only rapid that retracts runs together with the rapid after it
+
+compiler=Gcode_Compiler.Gcode_Compiler();   #modal G code state
+program=Gcode_Compiler.Gcode_Program();     #records of the line being run
+
+acceleration=2.0;             #mm/sec^2
+junction_deviation=0.02;      #mm, how far a corner may be rounded off when it is passed without stopping
+lookahead=16;                 #number of moves the planner looks ahead
+chord_tolerance=0.01;         #mm, how far the planner's sub-arcs may stray from the circle
+raster_lead=10.0;             #mm, longest lead-in and lead-out of a raster scanline, its ends ramp when it is cut short
+x_travel=305.0;               #mm, X travel from the origin, raster leads stay within it
+
+executor_process=True;        #step in a process of its own, the planner feeds it through a shared memory ring
+executor_cpu=3;               #cpu the executor is pinned to, None leaves it to the OS
+executor_priority=50;         #SCHED_FIFO priority of the executor (needs root), None for a normal process
+ring_size=256;                #planned segments the ring holds
+
+Laser_switch=15;              #laser gate, PWM when the backend has it
+laser_max_power=1000;         #S value of full laser power
+laser=None;                   #Laser, made in the process that runs the steps
+
+timing_log=False;             #record the intended and actual time of every step and write a report at the end
+
+scheduler=Step_Scheduler();    #times every step against an absolute deadline
+timing=None;
+if timing_log:
+  timing=Timing_Log()
+  scheduler.log=timing
+runner=Segment_Runner(MX,MY,MZ,scheduler,laser,rapid_drive,timing)   #the laser is added where the steps run
+if executor_process:
+  ring=Segment_Ring(ring_size)
+  planner=Motion_Planner(ring.put,acceleration/min(dx,dy),junction_deviation/min(dx,dy),lookahead,(0,0),
+                         raster_lead/dx,(0,int(x_travel/dx)));
+  executor=multiprocessing.Process(target=executor_main)
+  executor.start()
+  ring.executor=executor                 #the planner stops with an error instead of waiting on a dead executor
+else:
+  laser=Laser(Laser_switch,GPIO,laser_max_power)
+  runner.laser=laser
+  planner=Motion_Planner(runner.run,acceleration/min(dx,dy),junction_deviation/min(dx,dy),lookahead,(0,0),
+                         raster_lead/dx,(0,int(x_travel/dx)));
+records=Record_Runner(planner,program,dx,dy,dz,speed,rapid_speed,rapid_drive,chord_tolerance,overlap_z,True)
 
 # Currently set to be conservative, diagonal cut will not exceed feed rate
 #MX.setFeedRate(dy,dx,feed_rate)
@@ -131,131 +173,44 @@ try: #try and handle interrupt gracefully
   port = serial.Serial("/dev/ttyAMA0", baudrate=115200, timeout=0.5)
   gcode = open(filename,'a')
 
-  print("Waiting for Serial Input...")
-  while True:
-    ch = port.read()
-    print("Serial Wait Loop")
-    if (ch != ''):
-      #Recieved not blank
-      print("Recieving Gcode from Serial")
-      gcode.write(ch)
-      break
+  # Lines are run as soon as they have arrived, the cut starts while the rest is still on its way.
+  # Every line is acknowledged once it has been taken in, so the sender knows how much room is left
+  receiver = Gcode_Receiver(port, gcode)
 
-  while True:
-    ch = port.read()
-    print('.')
-    if (ch == ''):
-      #end of transmission reached
+  print("Waiting for Serial Input...")
+  for lines in receiver.lines():
+    running = execute_line(lines)
+    receiver.ack()
+    if not running:
       break
-    gcode.write(ch)
-
-  #print("Gcode recieved and stored, starting cut in 5 seconds")
-  #delay(5000);
 
-  unused = input("Gcode recieved and stored, press enter to continue")
+  print("Gcode recieved and stored: %d lines, %d bytes" % (receiver.received_lines, receiver.received_bytes))
 
   gcode.close()
   port.close()
 
-
-###########################################################################################
-###########################################################################################
-#################                           ###############################################
-#################   Reading Stored Gcode    ###############################################
-#################                           ###############################################
-###########################################################################################
-###########################################################################################
-
-
-  for lines in open(filename,'r'):
-    if lines==[]:
-      1; #blank lines
-    elif lines[0:3]=='G90':
-      print 'start';
-       
-    elif lines[0:3]=='G20':# working in inch;
-      dx/=25.4;
-      dy/=25.4;
-      print 'Working in inch';
-         
-    elif lines[0:3]=='G21':# working in mm;
-      print 'Working in mm';  
-       
-    #elif lines[0:3]=='M05':
-    #  GPIO.output(Laser_switch,False);
-    # print 'Laser turned off';
-      
-    #elif lines[0:3]=='M03':
-    #  GPIO.output(Laser_switch,True);
-    #  print 'Laser turned on';
-
-    elif lines[0:3]=='M02':
-    # GPIO.output(Laser_switch,False);
-      print 'finished. shuting down';
-      break;
-    elif (lines[0:3]=='G1F')|(lines[0:4]=='G1 F'):
-      1;#do nothing
-    elif (lines[0:3]=='G0 ')|(lines[0:3]=='G1 ')|(lines[0:3]=='G01'):#|(lines[0:3]=='G02')|(lines[0:3]=='G03'):
-      #linear engraving movement
-      if (lines[0:3]=='G0 '):
-        engraving=False;
-      else:
-        engraving=True;
-         
-      [x_pos,y_pos]=XYposition(lines);
-      moveto(MX,x_pos,dx,MY,y_pos,dy,speed,engraving);
-       
-    elif (lines[0:3]=='G02')|(lines[0:3]=='G03'): #circular interpolation
-      old_x_pos=x_pos;
-      old_y_pos=y_pos;
-
-      [x_pos,y_pos]=XYposition(lines);
-      [i_pos,j_pos]=IJposition(lines);
-
-      xcenter=old_x_pos+i_pos;   #center of the circle for interpolation
-      ycenter=old_y_pos+j_pos;
-     
-     
-      Dx=x_pos-xcenter;
-      Dy=y_pos-ycenter;      #vector [Dx,Dy] points from the circle center to the new position
-     
-      r=sqrt(i_pos**2+j_pos**2);   # radius of the circle
-     
-      e1=[-i_pos,-j_pos]; #pointing from center to current position
-      if (lines[0:3]=='G02'): #clockwise
-        e2=[e1[1],-e1[0]];      #perpendicular to e1. e2 and e1 forms x-y system (clockwise)
-      else:                   #counterclock ise
-        e2=[-e1[1],e1[0]];      #perpendicular to e1. e1 and e2 forms x-y system (counterclockwise)
-
-      #[Dx,Dy]=e1*cos(theta)+e2*sin(theta), theta is the open angle
-
-      costheta=(Dx*e1[0]+Dy*e1[1])/r**2;
-      sintheta=(Dx*e2[0]+Dy*e2[1])/r**2;        #theta is the angule spanned by the circular interpolation curve
-         
-      if costheta>1:  # there will always be some numerical errors! Make sure abs(costheta)<=1
-        costheta=1;
-      elif costheta<-1:
-        costheta=-1;
-
-      theta=arccos(costheta);
-      if sintheta<0:
-        theta=2.0*pi-theta;
-
-      no_step=int(round(r*theta/dx/5.0));   # number of point for the circular interpolation
-     
-      for i in range(1,no_step+1):
-        tmp_theta=i*theta/no_step;
-        tmp_x_pos=xcenter+e1[0]*cos(tmp_theta)+e2[0]*sin(tmp_theta);
-        tmp_y_pos=ycenter+e1[1]*cos(tmp_theta)+e2[1]*sin(tmp_theta);
-        moveto(MX,tmp_x_pos,dx,MY, tmp_y_pos,dy,speed,True);
-     
 except KeyboardInterrupt:
     print("Terminated by keyboard interrupt, good by")
+except RuntimeError as error:
+    print("Job stopped: %s" % error)
  
-#GPIO.output(Laser_switch,False);   # turn off laser
-moveto(MX,0,dx,MY,0,dy,50,False);  # move back to Origin
+try:
+  records.finish(True);                  # turn off laser and move back to Origin, with a retract that is still held back
+  planner.flush();                       # run whatever is still queued
+  if executor_process:
+    ring.close()                         # the executor stops once the ring is empty
+except RuntimeError as error:
+  print("Could not finish the job: %s" % error)
+if executor_process:
+  executor.join()
+  print 'Segment ring:', ring.report();
+else:
+  laser.off();
+  print 'Step timing:', scheduler.report();
+  write_timing_report();
  
 MX.unhold();
 MY.unhold();
+MZ.unhold();
  
 GPIO.cleanup();
\ No newline at end of file
@@ -0,0 +1,248 @@
+import os
+import gc
+import time
+import ctypes
+import ctypes.util
+from multiprocessing import RawArray
+
+from Motion_Planner import Planner_Segment
+
+#Shared memory ring of planned segments
+#Lets the planner (serial, G code compiler, arc maths, console output) and the executor (the step
+#loops and the GPIO writes) run in two processes, so nothing the planner does, garbage collection
+#included, can hold up a step. The ring lives in shared memory made before the executor is forked.
+#There is one writer and one reader and each of them only ever moves its own counter, the writer
+#fills a slot before it moves the head and the reader empties one before it moves the tail, so no
+#lock is needed.
+#
+#A slot holds one Planner_Segment as 18 doubles. The runs of raster segments do not fit a slot, they
+#go into a second ring, the run pool, that is filled and emptied in the same order as the slots. The executor keeps statistics on how full the
+#ring was every time it took a segment, and counts an underrun whenever it ran dry while the
+#machine was moving, that is after a segment that does not end at standstill.
+#The planner side is given the executor process, so it stops with an error instead of waiting
+#forever for a slot once the executor has died.
+
+fields=('stepx','stepy','stepz','start_x','start_y','center_x','center_y','clockwise','length',
+        'entry_speed','nominal_speed','exit_speed','acceleration','engraving','line','laser','power',
+        'runs');   #number of runs in the run pool, -1 for a segment without runs
+num_field=len(fields);
+
+HEAD=0;        #segments put so far, only the planner writes it
+TAIL=1;        #segments taken so far, only the executor writes it
+CLOSED=2;      #1 once the planner has put its last segment
+RUN_HEAD=3;    #runs put and taken so far, the same as HEAD and TAIL for the run pool
+RUN_TAIL=4;
+
+#statistics, written by the executor
+GETS=0;
+FILL_SUM=1;
+FILL_MIN=2;
+FILL_MAX=3;
+UNDERRUNS=4;
+FULL_WAITS=5;  #written by the planner, times it had to wait for a free slot
+
+class Segment_Ring:
+
+    capacity=256;        #number of slots
+    poll_time=0.0005;    #sec, how long the waiting side sleeps before it looks again
+    run_capacity=65536;  #raster runs the run pool holds
+    executor=None;       #process that empties the ring (anything with is_alive()), None if it is not watched
+
+    def __init__(self,capacity=256,poll_time=0.0005,run_capacity=65536):
+        self.capacity=capacity;
+        self.poll_time=poll_time;
+        self.run_capacity=run_capacity;
+        self.slots=RawArray('d',capacity*num_field);
+        self.run_pool=RawArray('l',run_capacity);
+        self.counters=RawArray('l',5);
+        self.stats=RawArray('d',6);
+        self.stats[FILL_MIN]=capacity;
+        self.executor=None;
+
+    def fill(self):
+        return self.counters[HEAD]-self.counters[TAIL];
+
+    def check_executor(self):
+    #raise a RuntimeError if the executor has died, the segments left in the ring would never be taken
+        if self.executor is not None and not self.executor.is_alive():
+            raise RuntimeError('The executor has stopped with %d segments left in the ring'%self.fill());
+
+    def put(self,segment):
+    #copy a Planner_Segment into the ring, wait for a free slot when it is full
+    #has the signature of the planner's execute callback, so a Motion_Planner can feed the ring directly
+        counters=self.counters;
+        runs=segment.runs;
+        num_run=-1 if runs is None else len(runs);
+        if num_run>self.run_capacity:
+            raise ValueError('%d runs do not fit a run pool of %d'%(num_run,self.run_capacity));
+
+        if counters[HEAD]-counters[TAIL]>=self.capacity or counters[RUN_HEAD]+num_run-counters[RUN_TAIL]>self.run_capacity:
+            self.stats[FULL_WAITS]+=1;
+            while counters[HEAD]-counters[TAIL]>=self.capacity or counters[RUN_HEAD]+num_run-counters[RUN_TAIL]>self.run_capacity:
+                self.check_executor();
+                time.sleep(self.poll_time);
+
+        if num_run>0:
+            pool=self.run_pool;
+            n=counters[RUN_HEAD];
+            for run in runs:
+                pool[n%self.run_capacity]=run;
+                n+=1;
+            counters[RUN_HEAD]=n;
+
+        if segment.center is None:
+            [cx,cy]=[float('nan'),float('nan')];
+        else:
+            [cx,cy]=segment.center;
+
+        power=segment.power;
+        if power is None:
+            power=float('nan');   #no S word yet, full power
+
+        n=(counters[HEAD]%self.capacity)*num_field;
+        self.slots[n:n+num_field]=[segment.stepx,segment.stepy,segment.stepz,segment.start[0],segment.start[1],cx,cy,
+                                   segment.clockwise,segment.length,
+                                   segment.entry_speed,segment.nominal_speed,segment.exit_speed,
+                                   segment.acceleration,segment.engraving,segment.line,segment.laser,power,
+                                   num_run];
+        counters[HEAD]+=1;   #the slot is complete before the executor can see it
+        return 0;
+
+    def get(self):
+    #take the oldest segment out of the ring as a Planner_Segment, None if the ring is empty
+        counters=self.counters;
+        fill=counters[HEAD]-counters[TAIL];
+        if fill==0:
+            return None;
+
+        stats=self.stats;
+        stats[GETS]+=1;
+        stats[FILL_SUM]+=fill;
+        if fill<stats[FILL_MIN]:
+            stats[FILL_MIN]=fill;
+        if fill>stats[FILL_MAX]:
+            stats[FILL_MAX]=fill;
+
+        n=(counters[TAIL]%self.capacity)*num_field;
+        [stepx,stepy,stepz,xs,ys,cx,cy,clockwise,length,entry,nominal,exit,acceleration,engraving,line,laser,power,num_run]=self.slots[n:n+num_field];
+
+        runs=None;
+        if num_run>=0:
+            pool=self.run_pool;
+            n=counters[RUN_TAIL];
+            runs=tuple(pool[(n+k)%self.run_capacity] for k in range(int(num_run)));
+            counters[RUN_TAIL]=n+int(num_run);   #the runs are free before the slot is
+        counters[TAIL]+=1;
+
+        segment=Planner_Segment(int(stepx),int(stepy),nominal,acceleration,engraving!=0,int(stepz));
+        segment.start=(int(xs),int(ys));
+        if cx==cx:   #not nan
+            segment.center=(cx,cy);
+            segment.clockwise=clockwise!=0;
+            segment.length=length;
+        segment.entry_speed=entry;
+        segment.exit_speed=exit;
+        segment.line=int(line);
+        segment.laser=laser!=0;
+        segment.power=power if power==power else None;
+        segment.runs=runs;
+        return segment;
+
+    def close(self):
+    #no more segments will be put, the executor stops once the ring is empty
+    #raises a RuntimeError if the executor has already died and there are segments left
+        self.counters[CLOSED]=1;
+        if self.fill()>0:
+            self.check_executor();
+
+    def closed(self):
+        return self.counters[CLOSED]!=0;
+
+    def report(self):
+        stats=self.stats;
+        if stats[GETS]==0:
+            return 'No segments through the ring';
+        return ('%d segments, fill min %d, mean %.1f, max %d of %d, %d underruns, planner waited %d times'
+                %(stats[GETS],stats[FILL_MIN],stats[FILL_SUM]/stats[GETS],stats[FILL_MAX],self.capacity,
+                  stats[UNDERRUNS],stats[FULL_WAITS]));
+
+
+class sched_param(ctypes.Structure):
+    _fields_=[('sched_priority',ctypes.c_int)];
+
+SCHED_FIFO=1;   #Linux policy number, for the libc calls
+
+
+def libc_call(name,*args):
+#call the Linux libc function [name], which returns -1 and sets errno on failure
+#stands in for the os.sched_* functions, which python 2 does not have
+    libc=ctypes.CDLL(ctypes.util.find_library('c'),use_errno=True);
+    if libc[name](*args)!=0:
+        errno=ctypes.get_errno();
+        raise OSError(errno,os.strerror(errno));
+    return 0;
+
+
+def set_affinity(cpu):
+#pin the calling process to [cpu]
+    if hasattr(os,'sched_setaffinity'):
+        os.sched_setaffinity(0,[cpu]);
+        return 0;
+    mask=ctypes.c_ulong(1<<cpu);
+    return libc_call('sched_setaffinity',0,ctypes.sizeof(mask),ctypes.byref(mask));
+
+
+def set_fifo_priority(priority):
+#give the calling process the real time (SCHED_FIFO) [priority]
+    if hasattr(os,'sched_setscheduler'):
+        os.sched_setscheduler(0,os.SCHED_FIFO,os.sched_param(priority));
+        return 0;
+    param=sched_param(priority);
+    return libc_call('sched_setscheduler',0,SCHED_FIFO,ctypes.byref(param));
+
+
+def realtime_setup(cpu=None,priority=None):
+#pin the calling process to [cpu] and give it the real time (SCHED_FIFO) [priority]
+#the priority needs root. A failure is reported and otherwise ignored
+    if cpu is not None:
+        try:
+            set_affinity(cpu);
+        except (AttributeError,OSError) as error:
+            print('Could not pin the executor to cpu %d: %s'%(cpu,error));
+
+    if priority is not None:
+        try:
+            set_fifo_priority(priority);
+        except (AttributeError,OSError) as error:
+            print('Could not set real time priority %d: %s'%(priority,error));
+
+
+def run_executor(ring,execute,cpu=None,priority=None):
+#executor process: hand every segment in [ring] to [execute] until the ring is closed and empty
+    realtime_setup(cpu,priority);
+
+    #nothing the executor makes has reference cycles, so the collector only has to run while it is idle
+    gc.disable();
+    moving=False;   #the last segment did not end at standstill
+    idle=True;      #nothing has been executed since the last collection
+    try:
+        while True:
+            segment=ring.get();
+            if segment is None:
+                if moving:
+                    ring.stats[UNDERRUNS]+=1;   #the next segment is late, the machine stops short
+                    moving=False;
+                if ring.closed() and ring.fill()==0:   #the last segments may have come in before the ring was closed
+                    break;
+                if not idle:
+                    gc.collect();
+                    idle=True;
+                time.sleep(ring.poll_time);
+                continue;
+
+            execute(segment);
+            moving=segment.exit_speed>0;
+            idle=False;
+    finally:
+        gc.enable();
+    return 0;
@@ -0,0 +1,70 @@
+#Streaming G code receiver
+#Reads the serial port in chunks, frames the bytes into lines and hands every complete line
+#to the caller as soon as it has arrived, so the job starts while the rest of the file is
+#still on its way. Every line is acknowledged with 'ok' once the caller is done with it; a
+#sender that keeps track of the unacknowledged bytes can then keep the link busy without
+#overrunning the receive buffer.
+
+class Gcode_Receiver:
+
+    chunk_size=256;     #largest read in one go
+    ack_message=b'ok\n';
+
+    received_bytes=0;   #statistics
+    received_lines=0;
+
+    def __init__(self,port,log=None,chunk_size=256,ack_message=b'ok\n'):
+    #[port] is an open serial.Serial, its timeout decides how long a quiet line means the end of the job
+    #every chunk that is received is also written to [log], an open file, when it is given
+        self.port=port;
+        self.log=log;
+        self.chunk_size=chunk_size;
+        self.ack_message=ack_message;
+
+        self.received_bytes=0;
+        self.received_lines=0;
+
+    def waiting(self):
+    #number of bytes sitting in the receive buffer
+        if hasattr(self.port,'in_waiting'):
+            return self.port.in_waiting;
+        return self.port.inWaiting();   #pyserial 2
+
+    def read_chunk(self):
+    #block for the first byte (or the port timeout), then take whatever else has already arrived
+        data=self.port.read(1);
+        if data:
+            extra=min(self.waiting(),self.chunk_size-1);
+            if extra>0:
+                data+=self.port.read(extra);
+            self.received_bytes+=len(data);
+            if self.log is not None:
+                self.log.write(data.decode('ascii','ignore'));
+        return data;
+
+    def lines(self):
+    #generator of the received lines, each one ends with '\n'
+    #waits as long as it takes for the transmission to start, then stops after the port has been quiet for one timeout
+        pending='';
+        started=False;
+        while True:
+            data=self.read_chunk();
+            if not data:
+                if started:
+                    break;   #end of transmission
+                continue;
+            started=True;
+
+            pending+=data.decode('ascii','ignore').replace('\r','');
+            while '\n' in pending:
+                [line,pending]=pending.split('\n',1);
+                self.received_lines+=1;
+                yield line+'\n';
+
+        if pending.strip():   #last line without a newline
+            self.received_lines+=1;
+            yield pending+'\n';
+
+    def ack(self):
+    #tell the sender one more line has been taken out of the buffer
+        self.port.write(self.ack_message);
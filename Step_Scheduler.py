@@ -0,0 +1,86 @@
+import time
+
+#Deadline based step timing
+#Instead of sleeping a fixed delay after every step, each step gets an absolute deadline
+#counted from the start of the move. Time lost to GPIO calls and Python overhead is taken out
+#of the next wait, so the error does not build up over a move and the commanded feed is reached.
+#Waiting is a sleep until shortly before the deadline followed by a short spin, since
+#time.sleep on the Pi can overshoot by a good fraction of a millisecond.
+
+clock=getattr(time,'perf_counter',time.time)   #perf_counter does not exist on python 2
+
+class Step_Scheduler:
+
+    spin_time=0.0005;    #sec, the last stretch before a deadline is spent spinning
+    max_lag=0.002;       #sec, a scheduler that is further behind than this when a move starts is restarted
+
+    deadline=0.0;        #absolute time (clock) of the last step handed out
+
+    steps=0;             #statistics
+    late_steps=0;
+    total_lateness=0.0;
+    max_lateness=0.0;
+
+    log=None;            #Step_Timing.Timing_Log that gets every step, None to leave timing unrecorded
+
+    def __init__(self,spin_time=0.0005,max_lag=0.002,clock=clock,sleep=time.sleep):
+        self.spin_time=spin_time;
+        self.max_lag=max_lag;
+        self.clock=clock;
+        self.sleep=sleep;
+        self.log=None;
+
+        self.deadline=self.clock();
+        self.reset_statistics();
+
+    def reset_statistics(self):
+        self.steps=0;
+        self.late_steps=0;
+        self.total_lateness=0.0;
+        self.max_lateness=0.0;
+
+    def start(self):
+    #restart the deadlines from now
+        self.deadline=self.clock();
+        return self.deadline;
+
+    def resume(self):
+    #called at the start of every move. Moves that follow each other straight away keep one chain of
+    #deadlines, so the gap between two moves is made up for. After an idle period the chain is
+    #restarted instead of trying to catch up with a burst of steps
+        if self.clock()-self.deadline>self.max_lag:
+            self.start();
+        return self.deadline;
+
+    def wait_until(self,deadline):
+    #block until [deadline], return how late (sec) we are once it has passed
+        remaining=deadline-self.clock();
+        if remaining>self.spin_time:
+            self.sleep(remaining-self.spin_time);
+
+        now=self.clock();
+        while now<deadline:
+            now=self.clock();
+
+        lateness=now-deadline;
+        self.steps+=1;
+        if lateness>self.spin_time:     #coming out of the spin a little after the deadline is not counted as late
+            self.late_steps+=1;
+        self.total_lateness+=lateness;
+        if lateness>self.max_lateness:
+            self.max_lateness=lateness;
+        if self.log is not None:
+            self.log.step(deadline,now);
+        return lateness;
+
+    def wait(self,dt):
+    #advance the deadline by [dt] and wait for it
+        self.deadline+=dt;
+        return self.wait_until(self.deadline);
+
+    def report(self):
+        if self.steps==0:
+            return 'No steps scheduled';
+        return ('%d steps, %d late, accumulated lateness %.3f sec, mean %.1f us, max %.1f us'
+                %(self.steps,self.late_steps,self.total_lateness,
+                  1e6*self.total_lateness/self.steps,1e6*self.max_lateness));
@@ -0,0 +1,252 @@
+import os
+import sys
+import mmap
+import struct
+import hashlib
+
+import GPIO_Backend
+from Bipolar_Stepper_Motor_Class import Bipolar_Stepper_Motor, Pin_Bank
+from Job_Estimator import Job_Estimator
+from Laser_Control import Laser
+from Step_Scheduler import Step_Scheduler
+
+#Precompiled step streams
+#A G code job is compiled once into a binary timeline of pin states: the compiler, planner and
+#Motor_control step loops run on a Virtual_Clock (see Job_Estimator) and every GPIO write they make
+#is recorded as (time since the previous write, level of every pin). Replaying the file is then just
+#waiting for each deadline and writing the pins, no parsing or interpolation is left in the real
+#time loop. Streams are cached by a hash of the G code and the machine parameters, so a job that
+#is run again starts straight away.
+#
+#File layout, little endian:
+#  header   magic 'STEP', version (H), number of pins (H), number of records (Q), total time (d)
+#  pins     one H per pin, bit k of a record's levels is the level of pin k
+#  records  dt (d, sec since the previous record), levels (I)
+#
+#usage: python Step_Stream.py compile file.nc     compile (or find in the cache) and print the stream file
+#       python Step_Stream.py run file.nc         compile if needed, then replay on the GPIO backend
+
+magic=b'STEP';
+version=1;
+header_format=struct.Struct('<4sHHQd');
+record_format=struct.Struct('<dI');
+
+cache_dir='./Step_cache';
+
+motor_pins=((23,22,24,26),(11,7,5,3),(12,16,20,21));   #a1, a2, b1, b2 of X, Y and Z, as in SPi_Interface_V1
+laser_pin=15;                                           #Laser_switch, the recorder has no PWM so it is only switched
+
+
+class Step_Recorder(GPIO_Backend.Simulated_GPIO):
+#Simulated GPIO backend that writes a record to a step stream file for every output call
+#instead of keeping the transitions in memory
+
+    buffer_size=4096;   #records collected before they are written out
+
+    def __init__(self,stream,clock):
+        GPIO_Backend.Simulated_GPIO.__init__(self,clock);
+        self.stream=stream;
+        self.pins=[];          #pins in the order of the bits of a record
+        self.bits={};          #pin -> bit
+        self.mask=0;           #current levels
+        self.last_time=clock();
+        self.records=0;
+        self.pending=[];
+
+    def setup(self,pin,direction,initial=0):
+        GPIO_Backend.Simulated_GPIO.setup(self,pin,direction,initial);
+        if direction==self.OUT and pin not in self.bits:
+            self.bits[pin]=len(self.pins);
+            self.pins.append(pin);
+            if initial:
+                self.mask|=1<<self.bits[pin];
+
+    def output(self,pins,levels):
+        if not isinstance(pins,(list,tuple)):
+            pins=[pins];
+            levels=[levels];
+        elif not isinstance(levels,(list,tuple)):
+            levels=[levels]*len(pins);
+
+        mask=self.mask;
+        for pin,level in zip(pins,levels):
+            bit=1<<self.bits[pin];
+            if level:
+                mask|=bit;
+            else:
+                mask&=~bit;
+        self.mask=mask;
+
+        t=self.clock();
+        self.pending.append(record_format.pack(t-self.last_time,mask));
+        self.last_time=t;
+        self.records+=1;
+        if len(self.pending)>=self.buffer_size:
+            self.flush();
+
+        self.writes+=1;
+
+    def flush(self):
+        self.stream.write(b''.join(self.pending));
+        self.pending=[];
+
+
+def job_hash(gcode,estimator,pins=motor_pins,laser=laser_pin):
+#hash of the G code text [gcode] (bytes) and everything else that decides the steps
+    parameters=repr((version,pins,laser,estimator.dx,estimator.dy,estimator.dz,estimator.overlap_z,
+                     estimator.feed_rate,estimator.rapid_speed,
+                     estimator.acceleration,estimator.junction_deviation,estimator.lookahead,
+                     estimator.chord_tolerance,estimator.rapid_drive,estimator.raster_lead,estimator.x_travel));
+    digest=hashlib.sha1(gcode);
+    digest.update(parameters.encode('ascii'));
+    return digest.hexdigest();
+
+
+def compile_stream(lines,stream_name,estimator=None,pins=motor_pins,laser=laser_pin):
+#compile the G code lines of the iterable [lines] into the step stream file [stream_name]
+#the laser on pin [laser] is recorded with the steps, None leaves it out
+#returns the Job_Report of the run
+    if estimator is None:
+        estimator=Job_Estimator();
+
+    clock=GPIO_Backend.Virtual_Clock();
+    temporary=stream_name+'.part';   #a stream that was cut short is never mistaken for a finished one
+    stream=open(temporary,'wb');
+    try:
+        stream.write(header_format.pack(magic,version,0,0,0.0));
+        recorder=Step_Recorder(stream,clock);
+
+        bank=Pin_Bank(recorder);
+        MX=Bipolar_Stepper_Motor(pins[0][0],pins[0][1],pins[0][2],pins[0][3],bank,recorder);
+        MY=Bipolar_Stepper_Motor(pins[1][0],pins[1][1],pins[1][2],pins[1][3],bank,recorder);
+        MZ=Bipolar_Stepper_Motor(pins[2][0],pins[2][1],pins[2][2],pins[2][3],bank,recorder);
+        if laser is not None:
+            laser=Laser(laser,recorder);
+        stream.write(struct.pack('<%dH'%len(recorder.pins),*recorder.pins));
+
+        report=estimator.run(lines,MX,MY,clock,True,MZ,laser);
+        recorder.flush();
+
+        stream.seek(0);
+        stream.write(header_format.pack(magic,version,len(recorder.pins),recorder.records,report.total_time));
+    finally:
+        stream.close();
+
+    if os.path.exists(stream_name):   #os.rename does not replace a file on windows
+        os.remove(stream_name);
+    os.rename(temporary,stream_name);
+    return report;
+
+
+def compile_cached(filename,estimator=None,pins=motor_pins,directory=None,laser=laser_pin):
+#name of the step stream of the G code file [filename], compiled now unless the cache already has it
+    if estimator is None:
+        estimator=Job_Estimator();
+    if directory is None:
+        directory=cache_dir;
+
+    gcode=open(filename,'rb');
+    try:
+        text=gcode.read();
+    finally:
+        gcode.close();
+
+    stream_name=os.path.join(directory,job_hash(text,estimator,pins,laser)+'.steps');
+    if not os.path.exists(stream_name):
+        if not os.path.isdir(directory):
+            os.makedirs(directory);
+        compile_stream(text.decode('ascii','ignore').splitlines(),stream_name,estimator,pins,laser);
+    return stream_name;
+
+
+class Step_Stream:
+#A step stream file, memory mapped
+
+    pins=();
+    records=0;
+    total_time=0.0;
+
+    def __init__(self,stream_name):
+        self.file=open(stream_name,'rb');
+        self.map=mmap.mmap(self.file.fileno(),0,access=mmap.ACCESS_READ);
+
+        [tag,file_version,num_pin,self.records,self.total_time]=header_format.unpack_from(self.map,0);
+        if tag!=magic or file_version!=version:
+            self.close();
+            raise ValueError('%s is not a version %d step stream'%(stream_name,version));
+        self.pins=struct.unpack_from('<%dH'%num_pin,self.map,header_format.size);
+        self.offset=header_format.size+2*num_pin;   #first record
+
+    def __iter__(self):
+    #(dt, levels) of every record
+        unpack_from=record_format.unpack_from;
+        size=record_format.size;
+        data=self.map;
+        offset=self.offset;
+        for _ in range(self.records):
+            yield unpack_from(data,offset);
+            offset+=size;
+
+    def close(self):
+        self.map.close();
+        self.file.close();
+
+
+def replay(stream_name,gpio=None,scheduler=None):
+#write the pin states of the step stream [stream_name] to [gpio], each at its deadline
+#returns the scheduler, its report tells how well the deadlines were kept
+    if gpio is None:
+        gpio=GPIO_Backend.get_backend();
+    if scheduler is None:
+        scheduler=Step_Scheduler();
+
+    stream=Step_Stream(stream_name);
+    try:
+        pins=list(stream.pins);
+        gpio.setmode(gpio.BCM);
+        for pin in pins:
+            gpio.setup(pin,gpio.OUT);
+
+        #only the pins that change from one record to the next are written. The (pins, levels) of a
+        #change is worked out once for every pair of masks that comes up
+        changes={};
+        wait=scheduler.wait;
+        output=gpio.output;
+
+        output(pins,[0]*len(pins));   #the stream starts with every pin low
+        previous=0;
+        scheduler.start();
+        for [dt,mask] in stream:
+            key=(previous<<32)|mask;
+            change=changes.get(key);
+            if change is None:
+                changed=[k for k in range(len(pins)) if (previous^mask)>>k&1];
+                change=([pins[k] for k in changed],[(mask>>k)&1 for k in changed]);
+                changes[key]=change;
+            previous=mask;
+            wait(dt);
+            if change[0]:
+                output(change[0],change[1]);
+
+        output(pins,[0]*len(pins));   #unhold
+    finally:
+        stream.close();
+    return scheduler;
+
+
+if __name__ == "__main__":
+    if len(sys.argv)!=3 or sys.argv[1] not in ('compile','run'):
+        print('usage: python Step_Stream.py compile|run file.nc');
+        sys.exit(1);
+
+    stream_name=compile_cached(sys.argv[2]);
+    print(stream_name);
+
+    if sys.argv[1]=='run':
+        GPIO=GPIO_Backend.get_backend();
+        try:
+            scheduler=replay(stream_name,GPIO);
+            print('Step timing: %s'%scheduler.report());
+        except KeyboardInterrupt:
+            print("Terminated by keyboard interrupt, good by");
+        GPIO.cleanup();
@@ -0,0 +1,137 @@
+from array import array
+
+#Step timing instrumentation
+#A Timing_Log handed to a Step_Scheduler (scheduler.log) gets the intended and the actual time of
+#every step. They go into arrays allocated up front, so recording a step is two stores and no
+#allocation. The executor marks where every planned segment starts and ends, with the G code line
+#it comes from, which gives the feed achieved per line next to the one that was asked for.
+#At the end of the job write_report puts it all in a text file: a histogram of how late the steps
+#were, the missed deadlines, and the commanded, planned and achieved feed of every line.
+
+histogram_edges=(0.00001,0.00002,0.00005,0.0001,0.0002,0.0005,0.001,0.002,0.005,0.01);   #sec
+
+class Timing_Log:
+
+    capacity=1000000;      #steps that can be recorded, the rest are only counted
+    miss_threshold=0.0005; #sec, a step later than this has missed its deadline
+
+    steps=0;               #steps recorded
+    dropped=0;             #steps that did not fit
+
+    def __init__(self,capacity=1000000,miss_threshold=0.0005):
+        self.capacity=capacity;
+        self.miss_threshold=miss_threshold;
+
+        self.intended=array('d',[0.0])*capacity;
+        self.actual=array('d',[0.0])*capacity;
+        self.steps=0;
+        self.dropped=0;
+
+        #one entry per move
+        self.move_line=array('L');
+        self.move_length=array('d');    #steps along the path
+        self.move_speed=array('d');     #commanded speed, steps/sec
+        self.move_planned=array('d');   #time the planner worked out, sec
+        self.move_start=array('d');     #clock at the start and at the end of the move
+        self.move_end=array('d');
+        self.move_first=array('L');     #index of the first step of the move
+
+    def step(self,intended,actual):
+    #called by the scheduler for every step
+        n=self.steps;
+        if n<self.capacity:
+            self.intended[n]=intended;
+            self.actual[n]=actual;
+            self.steps=n+1;
+        else:
+            self.dropped+=1;
+
+    def begin_move(self,line,length,speed,planned,now):
+    #a move of [length] steps at [speed] steps/sec for G code line [line] starts at clock [now]
+    #[planned] is the time it should take
+        self.move_line.append(line);
+        self.move_length.append(length);
+        self.move_speed.append(speed);
+        self.move_planned.append(planned);
+        self.move_start.append(now);
+        self.move_end.append(now);
+        self.move_first.append(self.steps);
+
+    def end_move(self,now):
+        if len(self.move_end):
+            self.move_end[-1]=now;
+
+    def lateness(self):
+    #actual minus intended time of every recorded step, sec
+        return [a-i for i,a in zip(self.intended[:self.steps],self.actual[:self.steps])];
+
+    def histogram(self,lateness=None):
+    #number of steps in every bin of histogram_edges, the last bin holds everything later than the last edge
+        if lateness is None:
+            lateness=self.lateness();
+        counts=[0]*(len(histogram_edges)+1);
+        for late in lateness:
+            k=0;
+            while k<len(histogram_edges) and late>=histogram_edges[k]:
+                k+=1;
+            counts[k]+=1;
+        return counts;
+
+    def line_feeds(self):
+    #(line, moves, length, commanded speed, planned time, actual time) of every G code line, in the order they ran
+        lines={};
+        order=[];
+        for k in range(len(self.move_line)):
+            line=self.move_line[k];
+            if line not in lines:
+                lines[line]=[0,0.0,0.0,0.0,0.0];
+                order.append(line);
+            entry=lines[line];
+            entry[0]+=1;
+            entry[1]+=self.move_length[k];
+            entry[2]=max(entry[2],self.move_speed[k]);
+            entry[3]+=self.move_planned[k];
+            entry[4]+=self.move_end[k]-self.move_start[k];
+        return [(line,)+tuple(lines[line]) for line in order];
+
+    def write_report(self,filename,mm_per_step=None):
+    #write the end of job report to [filename]. Feeds are in steps/sec, and in mm/min when [mm_per_step] is given
+        lateness=self.lateness();
+        missed=sum(1 for late in lateness if late>self.miss_threshold);
+        report=open(filename,'w');
+        try:
+            report.write('Step timing report\n\n');
+            report.write('steps recorded   %d (%d more not recorded)\n'%(self.steps,self.dropped));
+            if lateness:
+                report.write('lateness         mean %.1f us, max %.1f us\n'
+                             %(1e6*sum(lateness)/len(lateness),1e6*max(lateness)));
+            report.write('missed deadlines %d (later than %.0f us)\n\n'%(missed,1e6*self.miss_threshold));
+
+            report.write('lateness histogram\n');
+            counts=self.histogram(lateness);
+            lower=0.0;
+            for k in range(len(counts)):
+                if k<len(histogram_edges):
+                    label='%7.0f - %-7.0f us'%(1e6*lower,1e6*histogram_edges[k]);
+                    lower=histogram_edges[k];
+                else:
+                    label='%7.0f us and later'%(1e6*lower);
+                report.write('  %s %10d\n'%(label,counts[k]));
+
+            unit='steps/s';
+            factor=1.0;
+            if mm_per_step is not None:
+                unit='mm/min';
+                factor=60.0*mm_per_step;
+            report.write('\nfeed per G code line (%s)\n'%unit);
+            report.write('  %6s %6s %10s %10s %10s %10s %7s\n'
+                         %('line','moves','length','commanded','planned','achieved','ratio'));
+            for [line,moves,length,speed,planned,actual] in self.line_feeds():
+                planned_feed=length/planned if planned>0 else 0.0;
+                achieved_feed=length/actual if actual>0 else 0.0;
+                ratio=achieved_feed/planned_feed if planned_feed>0 else 0.0;
+                report.write('  %6d %6d %10.1f %10.3f %10.3f %10.3f %7.3f\n'
+                             %(line,moves,length,factor*speed,factor*planned_feed,factor*achieved_feed,ratio));
+        finally:
+            report.close();
+        return missed;
@@ -0,0 +1,110 @@
+'''
+Benchmark of Gcode_Compiler
+
+Writes a few megabytes of G code to a temporary file and compiles it, then
+parses the same file the way SPi_Interface_V1 used to (prefix checks and
+XYposition/IJposition character loops) for comparison.
+
+usage: python benchmarks/bench_gcode_compiler.py [number of lines]
+'''
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import Gcode_Compiler
+
+
+def XYposition(lines):
+    # the X/Y parser SPi_Interface_V1 used before the compiler
+    xchar_loc = lines.index('X')
+    i = xchar_loc + 1
+    while (47 < ord(lines[i]) < 58) | (lines[i] == '.') | (lines[i] == '-'):
+        i += 1
+    x_pos = float(lines[xchar_loc + 1:i])
+
+    ychar_loc = lines.index('Y')
+    i = ychar_loc + 1
+    while (47 < ord(lines[i]) < 58) | (lines[i] == '.') | (lines[i] == '-'):
+        i += 1
+    y_pos = float(lines[ychar_loc + 1:i])
+
+    return x_pos, y_pos
+
+
+def IJposition(lines):
+    ichar_loc = lines.index('I')
+    i = ichar_loc + 1
+    while (47 < ord(lines[i]) < 58) | (lines[i] == '.') | (lines[i] == '-'):
+        i += 1
+    i_pos = float(lines[ichar_loc + 1:i])
+
+    jchar_loc = lines.index('J')
+    i = jchar_loc + 1
+    while (47 < ord(lines[i]) < 58) | (lines[i] == '.') | (lines[i] == '-'):
+        i += 1
+    j_pos = float(lines[jchar_loc + 1:i])
+
+    return i_pos, j_pos
+
+
+def legacy_parse(filename):
+    count = 0
+    for lines in open(filename, 'r'):
+        if (lines[0:3] == 'G1F') | (lines[0:4] == 'G1 F'):
+            pass
+        elif (lines[0:3] == 'G0 ') | (lines[0:3] == 'G1 ') | (lines[0:3] == 'G01'):
+            XYposition(lines)
+            count += 1
+        elif (lines[0:3] == 'G02') | (lines[0:3] == 'G03'):
+            XYposition(lines)
+            IJposition(lines)
+            count += 1
+    return count
+
+
+def write_job(filename, number_of_lines):
+    random.seed(0)
+    gcode = open(filename, 'w')
+    gcode.write("G90\nG21\nG0 X0. Y0.\nM03\nG1 F600.\n")
+    for k in range(number_of_lines):
+        x = random.uniform(0, 300)
+        y = random.uniform(0, 300)
+        if k % 10 == 0:
+            gcode.write("G02 X%.4f Y%.4f I%.4f J%.4f\n" % (x, y, random.uniform(-5, 5), random.uniform(-5, 5)))
+        elif k % 50 == 1:
+            gcode.write("G0 X%.4f Y%.4f\n" % (x, y))
+        else:
+            gcode.write("G1 X%.4f Y%.4f\n" % (x, y))
+    gcode.write("M05\nM02\n")
+    gcode.close()
+
+
+if __name__ == "__main__":
+    number_of_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    handle, filename = tempfile.mkstemp(suffix='.nc')
+    os.close(handle)
+    try:
+        write_job(filename, number_of_lines)
+        size = os.path.getsize(filename) / 1e6
+
+        compile_time = legacy_time = float('inf')
+        for _ in range(3):  # best of three
+            start = time.perf_counter()
+            program = Gcode_Compiler.compile_file(filename)
+            compile_time = min(compile_time, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            legacy_parse(filename)
+            legacy_time = min(legacy_time, time.perf_counter() - start)
+    finally:
+        os.remove(filename)
+
+    print("%.1f MB, %d lines, %d records" % (size, number_of_lines + 7, len(program)))
+    print("Gcode_Compiler  %.2f s  %8.0f lines/s" % (compile_time, number_of_lines / compile_time))
+    print("legacy parser   %.2f s  %8.0f lines/s" % (legacy_time, number_of_lines / legacy_time))
@@ -0,0 +1,111 @@
+'''
+Benchmark of Motor_control.Motor_Step
+
+Compares the LCM based interpolation Motor_Step used to do against the DDA
+engine it uses now. Step timing is switched off and the steppers only count
+the steps they are asked for, so the numbers show loop iterations and the Python
+overhead of the interpolation itself.
+
+usage: python benchmarks/bench_motor_step.py
+'''
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import Motor_control
+
+
+class Counting_Bank:
+    # stands in for Pin_Bank, only keeps count of the writes
+    def __init__(self):
+        self.staged = 0
+        self.writes = 0
+
+    def commit(self):
+        if self.staged:
+            self.writes += 1
+            self.staged = 0
+
+
+class Counting_Stepper:
+    # stands in for Bipolar_Stepper_Motor, only keeps count of the steps
+    def __init__(self, bank=None):
+        self.position = 0
+        self.bank = bank or Counting_Bank()
+
+    def stage(self, direction):
+        self.position += direction
+        self.bank.staged += 1
+
+    def move(self, direction, steps, delay=0.2):
+        for _ in range(steps):
+            self.stage(direction)
+            self.bank.commit()
+
+
+class No_Wait:
+    # stands in for Step_Scheduler, hands out every step straight away
+    def resume(self):
+        pass
+
+    def wait(self, dt):
+        pass
+
+
+def LCM_Motor_Step(stepper1, step1, stepper2, step2, speed):
+    # the interpolation Motor_Step used before the DDA engine, returns the number of loop iterations
+    sign = Motor_control.sign
+    dir1 = sign(step1)
+    dir2 = sign(step2)
+    step1 = abs(step1)
+    step2 = abs(step2)
+
+    if step1 == 0:
+        total_micro_step = step2
+        micro_step2 = 1
+        micro_step1 = step2 + 100
+    elif step2 == 0:
+        total_micro_step = step1
+        micro_step1 = 1
+        micro_step2 = step1 + 100
+    else:
+        total_micro_step = Motor_control.LCM(step1, step2)
+        micro_step1 = total_micro_step // step1
+        micro_step2 = total_micro_step // step2
+
+    for i in range(1, total_micro_step + 1):
+        if (i % micro_step1) == 0:
+            stepper1.move(dir1, 1, 0)
+        if (i % micro_step2) == 0:
+            stepper2.move(dir2, 1, 0)
+
+    return total_micro_step
+
+
+def run(step1, step2):
+    m1 = Counting_Stepper()
+    m2 = Counting_Stepper()
+    start = time.perf_counter()
+    lcm_iterations = LCM_Motor_Step(m1, step1, m2, step2, 100)
+    lcm_time = time.perf_counter() - start
+    assert (m1.position, m2.position) == (step1, step2)
+
+    bank = Counting_Bank()
+    m1 = Counting_Stepper(bank)
+    m2 = Counting_Stepper(bank)
+    start = time.perf_counter()
+    Motor_control.Motor_Step(m1, step1, m2, step2, 100, No_Wait())
+    dda_time = time.perf_counter() - start
+    dda_iterations = max(abs(step1), abs(step2))
+    assert (m1.position, m2.position) == (step1, step2)
+
+    print("%6d %6d | %10d %9.4f s | %8d %9.4f s" % (step1, step2, lcm_iterations, lcm_time, dda_iterations, dda_time))
+
+
+if __name__ == "__main__":
+    print(" step1  step2 |   LCM loop iterations  |   DDA loop iterations")
+    for step1, step2 in [(100, 50), (400, -300), (997, 991), (-1999, 1997), (4001, 3989)]:
+        run(step1, step2)
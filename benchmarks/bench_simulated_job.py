@@ -0,0 +1,66 @@
+'''
+Run a job on the simulated GPIO backend
+
+Two motors on a Simulated_GPIO backend trace a spiral through the motion
+planner, the same way SPi_Interface_V1 drives the machine. The virtual clock
+only moves when the scheduler sleeps, so the job finishes in a fraction of its
+machine time and the recorded pin transitions give the exact step timing.
+
+usage: python benchmarks/bench_simulated_job.py
+'''
+
+import os
+import sys
+import time
+from math import pi, sin, cos
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import GPIO_Backend
+import Motor_control
+from Bipolar_Stepper_Motor_Class import Bipolar_Stepper_Motor, Pin_Bank
+from Motion_Planner import Motion_Planner
+
+
+def spiral(turns=10, points_per_turn=72, pitch=40):
+    points = []
+    for k in range(turns * points_per_turn + 1):
+        theta = 2 * pi * k / points_per_turn
+        r = pitch * theta / (2 * pi)
+        points.append((int(round(r * cos(theta))), int(round(r * sin(theta)))))
+    return points
+
+
+if __name__ == "__main__":
+    clock = GPIO_Backend.Virtual_Clock()
+    gpio = GPIO_Backend.set_backend(GPIO_Backend.Simulated_GPIO(clock))
+    scheduler = clock.scheduler()
+
+    bank = Pin_Bank()
+    MX = Bipolar_Stepper_Motor(23, 22, 24, 26, bank)
+    MY = Bipolar_Stepper_Motor(11, 7, 5, 3, bank)
+
+    def execute_segment(segment):
+        Motor_control.Motor_Step_Profile(MX, segment.stepx, MY, segment.stepy,
+                                         segment.entry_speed, segment.nominal_speed, segment.exit_speed,
+                                         segment.acceleration, scheduler)
+
+    planner = Motion_Planner(execute_segment, 2000.0, 2.0, 16)
+
+    start = time.perf_counter()
+    for x, y in spiral():
+        planner.moveto(x, y, 400.0, True)
+    planner.moveto(0, 0, 800.0, False)
+    planner.flush()
+    wall = time.perf_counter() - start
+
+    x_steps = gpio.edge_times(MX.pins)
+    y_steps = gpio.edge_times(MY.pins)
+    intervals = [b - a for a, b in zip(x_steps, x_steps[1:]) if b > a]
+
+    print("machine time  %.3f s" % clock())
+    print("wall time     %.3f s (%.0fx faster than real time)" % (wall, clock() / wall))
+    print("GPIO writes   %d, pin transitions %d" % (gpio.writes, len(gpio.transitions)))
+    print("steps         X %d, Y %d" % (len(x_steps), len(y_steps)))
+    print("X step rate   min %.1f, max %.1f steps/s" % (1 / max(intervals), 1 / min(intervals)))
+    print("scheduler     %s" % scheduler.report())
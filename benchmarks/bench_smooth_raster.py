@@ -0,0 +1,47 @@
+'''
+Benchmark of im_to_g_code.smoothRasterCoords
+
+Traces the outline of a filled blob drawn at growing sizes, so the outlines
+have from a few hundred to tens of thousands of points, and simplifies them
+with smoothRasterCoords.
+
+usage: python benchmarks/bench_smooth_raster.py
+'''
+
+import os
+import sys
+import time
+from math import pi, sin, cos
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from PIL import Image, ImageDraw
+
+import im_to_g_code
+
+
+def blobOutline(size):
+    # outline of a wobbly filled shape drawn on a size x size image
+    im = Image.new("RGB", (size, size), "white")
+    c = size / 2
+    points = []
+    for k in range(360):
+        a = 2 * pi * k / 360
+        r = size * (0.3 + 0.1 * sin(5 * a) + 0.03 * cos(17 * a))
+        points.append((c + r * cos(a), c + r * sin(a)))
+    ImageDraw.Draw(im).polygon(points, fill="black")
+    return im_to_g_code.traceShapes(im_to_g_code.imageMask(im, size))
+
+
+if __name__ == "__main__":
+    print(" points | smoothRasterCoords")
+    for size in [100, 200, 400, 1600, 6400]:
+        shapes = blobOutline(size)
+        n = sum(len(shape) for shape in shapes)
+
+        start = time.perf_counter()
+        smooth = im_to_g_code.smoothRasterCoords(shapes)
+        new_time = time.perf_counter() - start
+        kept = sum(len(shape) for shape in smooth)
+
+        print("%7d | %8.3f s, %5d points" % (n, new_time, kept))
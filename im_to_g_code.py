@@ -5,62 +5,306 @@ Last modified: July 24, 2015
 '''
 
 # Import Python Image Library
-from PIL import Image, ImageDraw, ImageEnhance
+from PIL import Image, ImageDraw
+
+# Import NumPy
+import numpy
 
 # Import PySerial
 import serial
 import serial.tools.list_ports
 
-# Import system time (this is the only module you don't need to download)
+# Import system time, collections, mmap, math, io, gzip and multiprocessing
+# (the only modules you don't need to download)
 import time
+import collections
+import mmap
+import math
+import io
+import gzip
+import multiprocessing
 
 # Global values
-imdim = 305         # Pixels in each dimension of image, 305 mm in 12 inches
+imdim = 305         # Size of the work area in each dimension, 305 mm in 12 inches
+rasterDPI = 25.4    # Pixels per inch raster images are sampled at, 25.4 is 1 per mm
+rasterThreshold = None  # Grey level (0-255) below which a pixel is dark, None for Otsu
+tileRows = 256      # Rows of a raster mask that are resampled at a time
+traceProcesses = None   # Processes tracing shapes at once, None for one per core
 smoothError = 1     # Rounding error when approx. raster with straight lines
-done = []           # Record of all coordinates that were read from the image
-direc = 0           # Current direction for tracing algorithm
-                    # (0 = right, 1 = up, 2 = left, 3 = down)
-
-
-def initRaster(filename):
+baudrate = 115200   # Speed of the serial link, the same as the Pi opens its port with
+rxBuffer = 128      # Bytes the receiver can buffer, lines sent are kept within
+ackTimeout = None   # Seconds to wait for an acknowledgement, None waits while the link is up
+ackPoll = 1         # Seconds between checks of the link while waiting for one
+arcStep = 5         # Degrees of a DXF arc or circle per straight segment
+rasterGap = 10      # Blank pixels in a row that are skipped instead of scanned
+rasterFeed = 1200   # Feed of raster scanlines, mm/min
+laserPower = 1000   # S value of the laser for raster fills
+resolution = 0.075  # Machine step in mm (dx, dy on the Pi), sets the decimals written
+writeBuffer = 65536 # Bytes collected before a G code file is written to
+gzipOutput = False  # Also compress the G code file with gzip
+
+
+def initRaster(filename, size):
     '''
-    Return the raster image represented by the file name. The file must be
-    in the local folder.
+    Return the raster image represented by the file name, opened but not yet
+    decoded. The file must be in the local folder. A JPEG is set to decode
+    straight to grey at a half, a quarter or an eighth of its size, as small
+    as it can be without going below size pixels.
 
     Arguments:
         filename is of type string. Contains name of image file.
+        size is of type int. Pixels in each dimension of the mask made of it.
     '''
 
-    global imdim
     im = Image.open(filename)
 
-    # Increase contrast of image
-    im = ImageEnhance.Contrast(im)
-    im = im.enhance(2)
-
-    # Resize to imdim x imdim
-    im = im.resize((imdim, imdim))
+    # Draft mode only does anything for JPEG files
+    im.draft("L", (size, size))
 
     return im
 
 
-def initDXF(filename):
+def otsuThreshold(histogram):
     '''
-    Return the DXF text file represented by the file name. The file must be
-    in the local folder.
+    Return the grey level that best splits the pixels into dark and light
+    (Otsu's method): pixels below it are dark. It is the split for which the
+    variance between the two classes is largest, computed for all 256 levels
+    at once.
+
+    Arguments:
+        histogram is of type ndarray. Number of pixels of every grey level.
+    '''
+
+    levels = numpy.arange(256)
+    histogram = histogram.astype(float)
+
+    # Pixels, and sum of their levels, at or below every level
+    weight = numpy.cumsum(histogram)
+    moment = numpy.cumsum(histogram * levels)
+    total = weight[-1]
+
+    with numpy.errstate(divide = "ignore", invalid = "ignore"):
+        between = (moment[-1] * weight - moment * total) ** 2 / \
+                  (weight * (total - weight))
+
+    # Levels that leave one class empty don't split anything
+    between[~numpy.isfinite(between)] = 0
+
+    return int(numpy.argmax(between)) + 1
+
+
+def rasterMask(filename):
+    '''
+    Return a tuple (mask, pixel). mask is a boolean NumPy array which is True
+    wherever the image is dark, indexed [x, y] like im.getpixel((x, y)); it
+    covers imdim x imdim mm at rasterDPI. pixel is the size of a pixel in mm.
 
     Arguments:
         filename is of type string. Contains name of image file.
     '''
 
-    file = open(filename)
+    size = max(1, int(round(imdim * rasterDPI / 25.4)))
+    mask = imageMask(initRaster(filename, size), size)
+
+    return mask, float(imdim) / size
+
+
+def imageMask(im, size):
+    '''
+    Return a boolean NumPy array of size x size pixels which is True wherever
+    the image is dark, indexed [x, y] like im.getpixel((x, y)).
+
+    The image is converted to grey and resampled tileRows rows of the mask at
+    a time, so apart from the image and the mask only one tile is ever held.
+    The threshold is rasterThreshold, or found with Otsu's method, in which
+    case a first pass over the tiles collects the histogram.
+
+    Arguments:
+        im is of type Image. Contains the image which is being processed.
+        size is of type int. Pixels in each dimension of the mask.
+    '''
+
+    width, height = im.size
+
+    def tiles():
+        # Grey rows of the mask from top to bottom, tileRows at a time
+        for top in range(0, size, tileRows):
+            bottom = min(top + tileRows, size)
+
+            # Part of the image these rows of the mask come from, averaged down
+            box = (0, top * height / size, width, bottom * height / size)
+            tile = im.resize((size, bottom - top), Image.BOX, box)
+            if tile.mode != "L":
+                tile = tile.convert("L")
+
+            yield top, bottom, numpy.asarray(tile)
+
+    if rasterThreshold is None:
+        histogram = numpy.zeros(256, dtype=numpy.int64)
+        for top, bottom, grey in tiles():
+            histogram += numpy.bincount(grey.ravel(), minlength=256)
+        threshold = otsuThreshold(histogram)
+    else:
+        threshold = rasterThreshold
+
+    # Every tile is thresholded straight into its columns of the mask
+    mask = numpy.empty((size, size), dtype=bool)
+    for top, bottom, grey in tiles():
+        mask[:, top:bottom] = (grey < threshold).T
+
+    return mask
+
+
+def dxfGroups(filename):
+    '''
+    Generate the (group code, value) pairs of the DXF file represented by the
+    file name, one at a time. The file must be in the local folder. A DXF file
+    is a text file of lines that come in pairs, an integer group code and then
+    its value. The file is memory-mapped and read one line at a time, so even
+    very large files are never held in memory at once.
+
+    Arguments:
+        filename is of type string. Contains name of DXF file.
+    '''
+
+    file = open(filename, "rb")
+
+    try:
+        # An empty file can't be mapped, and has nothing in it anyway
+        try:
+            DXFmap = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+        except ValueError:
+            return
+
+        try:
+            while True:
+                code = DXFmap.readline()
+                value = DXFmap.readline()
+
+                if not value:
+                    break
+
+                yield (int(code), value.strip().decode("latin-1"))
+        finally:
+            DXFmap.close()
+    finally:
+        file.close()
+
+
+def dxfEntities(filename):
+    '''
+    Generate the entities of the DXF file represented by the file name as
+    tuples (type, groups), where type is a string such as "LINE" and groups is
+    the list of (group code, value) pairs that describe it. Group code 0
+    starts every entity; VERTEX and SEQEND come as entities of their own.
+
+    Arguments:
+        filename is of type string. Contains name of DXF file.
+    '''
 
-    # Since dxf is a fancy extension for a text file, it can be read as a string
-    DXFtxt = file.readlines()
+    kind = None
+    groups = []
 
-    file.close()
+    for code, value in dxfGroups(filename):
+        if code == 0:
+            if kind is not None:
+                yield (kind, groups)
+            kind = value
+            groups = []
+        elif kind is not None:
+            groups.append((code, value))
 
-    return DXFtxt
+    if kind is not None:
+        yield (kind, groups)
+
+
+def arcPoints(cx, cy, r, start, end):
+    '''
+    Return a list of [x, y] points along a circular arc, one point at least
+    every arcStep degrees. The arc goes counterclockwise from angle start to
+    angle end, like in DXF.
+
+    Arguments:
+        cx, cy are of type float. Centre of the arc.
+        r is of type float. Radius of the arc.
+        start, end are of type float. Start and end angles in degrees.
+    '''
+
+    sweep = (end - start) % 360
+    if sweep == 0: sweep = 360
+
+    steps = max(1, int(numpy.ceil(sweep / arcStep)))
+    angles = numpy.radians(start + sweep * numpy.arange(steps + 1) / steps)
+
+    return numpy.column_stack((cx + r * numpy.cos(angles),
+                               cy + r * numpy.sin(angles))).tolist()
+
+
+def dxfShapes(filename):
+    '''
+    Generate the shapes of the DXF file represented by the file name, one at a
+    time, as lists of [x, y] coordinates. POLYLINE (with its VERTEX entities),
+    LWPOLYLINE, LINE, ARC and CIRCLE entities are read, anything else is
+    skipped. Arcs and circles are approximated with straight segments.
+
+    Arguments:
+        filename is of type string. Contains name of DXF file.
+    '''
+
+    # Shape of the POLYLINE whose vertices are being read, if any
+    polyline = None
+    closed = False
+
+    for kind, groups in dxfEntities(filename):
+        if kind == "VERTEX":
+            if polyline is not None:
+                values = dict(groups)
+                polyline.append([float(values[10]), float(values[20])])
+            continue
+
+        # Any other entity ends the POLYLINE, normally that is SEQEND
+        if polyline is not None:
+            if closed and polyline: polyline.append(list(polyline[0]))
+            yield polyline
+            polyline = None
+
+        if kind == "POLYLINE":
+            polyline = []
+            closed = int(dict(groups).get(70, 0)) & 1 == 1
+
+        elif kind == "LWPOLYLINE":
+            # Coordinates come as a run of 10, 20 pairs
+            shape = []
+            closed = False
+            for code, value in groups:
+                if code == 10:
+                    x = float(value)
+                elif code == 20:
+                    shape.append([x, float(value)])
+                elif code == 70:
+                    closed = int(value) & 1 == 1
+            if closed and shape: shape.append(list(shape[0]))
+            yield shape
+
+        elif kind == "LINE":
+            values = dict(groups)
+            yield [[float(values[10]), float(values[20])],
+                   [float(values[11]), float(values[21])]]
+
+        elif kind == "ARC":
+            values = dict(groups)
+            yield arcPoints(float(values[10]), float(values[20]),
+                            float(values[40]), float(values[50]),
+                            float(values[51]))
+
+        elif kind == "CIRCLE":
+            values = dict(groups)
+            yield arcPoints(float(values[10]), float(values[20]),
+                            float(values[40]), 0, 360)
+
+    if polyline is not None:
+        if closed and polyline: polyline.append(list(polyline[0]))
+        yield polyline
 
 
 def scale(path):
@@ -116,6 +360,10 @@ def smoothRasterCoords(coords):
          |-|      --->      \        AND     o--o--o--o   --->   o--------o
            |-                \
 
+    Each shape is simplified with the Ramer-Douglas-Peucker algorithm: points
+    that are less than smoothError from the segment between the points that
+    are kept are removed.
+
     Arguments:
         coords is of type list. Contains sublists of tuples, where each tuple is
                                 an (x, y) coordinate.
@@ -124,180 +372,437 @@ def smoothRasterCoords(coords):
     newCoords = []
 
     # For each shape in coords
-    for s in range(len(coords)):
-        newCoords.append([])
-
+    for shape in coords:
         # If it's a simple shape without removable elements, copy it and skip to
         # the next one
-        if len(coords[s]) <= 2:
-            newCoords[s] = coords[s]
+        if len(shape) <= 2:
+            newCoords.append(shape)
             continue
 
-        i = 0
-
-        # For each point i in the coordinate list
-        while i < len(coords[s]) - 2:
-            j = len(coords[s]) - 1
-
-            # For each point j between i and the end of the list
-            while j > i + 1:
-                # List of all points between i and j
-                midpoints = coords[s][i + 1:j]
-
-                # In usual case, draw line between i and j
-                try:
-                    m = (coords[s][j][1] - coords[s][i][1]) /\
-                        (coords[s][j][0] - coords[s][i][0])
-                    b = coords[s][i][1] - m * coords[s][i][0]
-
-                    canDel = True
-
-                    for point in midpoints:
-                        if linePointDist(m, b, point) >= smoothError:
-                            canDel = False
-                            break
-
-                    # If all points between i and j are within smoothError of
-                    # the line, remove them
-                    if canDel == True:
-                        newCoords[s].append(coords[s][i])
-                        newCoords[s].append(coords[s][j])
-                        i = j
-
-                # In special case where the line is vertical, m = infinity
-                except ZeroDivisionError:
-                    canDel = True
-
-                    for point in midpoints:
-                        if abs(coords[s][i][0] - point[0]) >= smoothError:
-                            canDel = False
-                            break
-
-                    # If all points between i and j are within smoothError of
-                    # the line, remove them
-                    if canDel == True:
-                        newCoords[s].append(coords[s][i])
-                        newCoords[s].append(coords[s][j])
-                        i = j
-                j -= 1
-            i += 1
-
-    # If a shape did not have removable points, copy the original coordinates
-    for i in range(len(newCoords)):
-        if len(newCoords[i]) == 0: newCoords[i] = coords[i]
+        newCoords.append(simplifyShape(shape))
 
     return newCoords
 
 
-def isOnEdge(im, px):
+def simplifyShape(shape):
     '''
-    Return a boolean value that corresponds to whether any of the adjacent
-    coordinates are not in the shape, hence whether the current coordinate is on
-    the edge.
-    
+    Return the points of shape that are needed to keep every removed point
+    within smoothError of the simplified outline (Ramer-Douglas-Peucker).
+
     Arguments:
-        im is of type Image. Contains the image which is being processed.
-        px is of type tuple. Contains float elements (x, y) which represent the
-                             coordinate being checked.
+        shape is of type list. Contains tuples, where each tuple is an (x, y)
+                               coordinate.
     '''
-    
-    hues = []
-    
-    # Literal edge cases
-    try: hues.append(sum(im.getpixel((px[0] - 1, px[1]))))
-    except IndexError: hues.append(sum((255, 255, 255)))
-    
-    try: hues.append(sum(im.getpixel((px[0], px[1] - 1))))
-    except IndexError: hues.append(sum((255, 255, 255)))
-    
-    try: hues.append(sum(im.getpixel((px[0] + 1, px[1]))))
-    except IndexError: hues.append(sum((255, 255, 255)))
-    
-    try: hues.append(sum(im.getpixel((px[0], px[1] + 1))))
-    except IndexError: hues.append(sum((255, 255, 255)))    
 
-    if (max(hues) > sum((127, 127, 127))):
-        return True
+    points = numpy.asarray(shape, dtype=float)
+    n = len(points)
+
+    # The first and the last point are always kept
+    keep = numpy.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+
+    # Stack of (i, j) pairs of kept points with points between them to check
+    stack = [(0, n - 1)]
+
+    while stack:
+        i, j = stack.pop()
+        if j <= i + 1:
+            continue
+
+        # Distance of all points between i and j to the segment from i to j
+        d = segmentDistances(points[i + 1:j], points[i], points[j])
+        k = int(numpy.argmax(d))
+
+        # If the farthest point is not within smoothError, keep it and check
+        # both halves again
+        if d[k] >= smoothError:
+            k += i + 1
+            keep[k] = True
+            stack.append((i, k))
+            stack.append((k, j))
+
+    return [shape[k] for k in numpy.flatnonzero(keep)]
+
+
+def segmentDistances(points, a, b):
+    '''
+    Return a NumPy array with the distance of every point to the line segment
+    from a to b.
+
+    Arguments:
+        points is of type ndarray. Contains one (x, y) coordinate per row.
+        a, b are of type ndarray. They represent (x, y) coordinates.
+    '''
+
+    ab = b - a
+    length2 = ab.dot(ab)
+
+    # Segment of length zero, e.g. a closed shape, measure to the point
+    if length2 == 0:
+        return numpy.hypot(points[:, 0] - a[0], points[:, 1] - a[1])
+
+    # Position of the foot of the perpendicular along the segment, 0 to 1
+    t = ((points - a).dot(ab) / length2).clip(0, 1)
+
+    foot = a + t[:, numpy.newaxis] * ab
+    return numpy.hypot(points[:, 0] - foot[:, 0], points[:, 1] - foot[:, 1])
+
+
+def rasterSpans(mask):
+    '''
+    Return a list of tuples (y, starts, ends), one for every row of the image
+    with dark pixels in it; blank rows are left out. starts and ends are NumPy
+    arrays holding, for every run of dark pixels in the row, the x of its first
+    pixel and the x just after its last pixel. All rows are searched at once.
+
+    Arguments:
+        mask is of type ndarray. Contains the dark pixels, indexed [x, y].
+    '''
+
+    # Rows of the image, with a light pixel added at both ends
+    rows = numpy.zeros((mask.shape[1], mask.shape[0] + 2), dtype=numpy.int8)
+    rows[:, 1:-1] = mask.T
+
+    # A run starts where the row goes from light to dark and ends where it
+    # goes back. nonzero goes row by row, so the runs of a row come in order
+    change = numpy.diff(rows, axis=1)
+    startY, startX = numpy.nonzero(change == 1)
+    endY, endX = numpy.nonzero(change == -1)
+
+    # Every row has as many ends as starts, so both split at the same places
+    y, first = numpy.unique(startY, return_index=True)
+    starts = numpy.split(startX, first[1:])
+    ends = numpy.split(endX, first[1:])
+
+    return list(zip(y.tolist(), starts, ends))
+
+
+def rasterLine(y, starts, ends, forward, pixel = 1.0):
+    '''
+    Return the G07 line that burns the runs of dark pixels of one scanline.
+    The line starts at the first dark pixel in the direction of travel and
+    holds the run lengths, dark and blank in turn, so a whole scanline is one
+    short line of G code instead of a line per run.
+
+    Arguments:
+        y is of type int. Row of the scanline.
+        starts and ends are of type ndarray. First pixel and pixel after the
+                                             last of every run, left to right.
+        forward is of type bool. True to scan left to right.
+        pixel is of type float. Size of a pixel in mm.
+    '''
+
+    # Dark runs at the even places, the blank runs between them in between
+    runs = numpy.empty(2 * len(starts) - 1, dtype=int)
+    runs[0::2] = ends - starts
+    runs[1::2] = starts[1:] - ends[:-1]
+
+    if forward:
+        x, step = starts[0], pixel
     else:
-        return False
+        x, step = ends[-1], -pixel
+        runs = runs[::-1]
 
+    # Positions in whole units of the written decimals, like gcodeLines. The
+    # pitch is written in full, any error in it would add up along the line
+    decimals = gcodeDecimals()
+    scale = 10 ** decimals
+    words = [(letter, int(round(value * scale))) for letter, value in
+             (("X", x * pixel), ("Y", y * pixel))]
+    pitch = ("%.9g" % step).replace("0.", ".", 1) if abs(step) < 1 else "%.9g" % step
 
-def nextPixelInShape(im, px):
+    return "G7%sI%s%s\n" % \
+           ("".join(letter + gcodeNumber(units, decimals) for letter, units in words), pitch,
+            "".join("R%d" % run for run in runs.tolist()))
+
+
+def fillLines(spans, pixel = 1.0):
+    '''
+    Generate the lines of G code that fill the dark areas of a raster image,
+    one at a time. Every row is scanned from whichever of its ends is nearer
+    to where the last one finished, so there is no travel back across the
+    image between them. A row is split
+    where it has more than rasterGap blank pixels in a row, the laser then
+    moves over the gap at travel speed.
+
+    Arguments:
+        spans is of type list. Contains the tuples returned by rasterSpans.
+        pixel is of type float. Size of a pixel in mm.
     '''
-    Return a tuple which represents the next coordinate when proceeding
-    clockwise around a shape. It is an implementation of the square tracing
-    algorithm, which works as follows:
+
+    # Boilerplate text, as for outlines, then the feed and the laser on
+    yield "G17 G21 G90 G54\n"
+    yield "G0X0Y0\n"
+    yield "F%d\n" % rasterFeed
+    yield "M3S%d\n" % laserPower
+
+    # Pixel the head is at, it starts from the origin
+    head = 0
+
+    for y, starts, ends in spans:
+        # Pieces of the row that are scanned on their own, left to right
+        breaks = numpy.nonzero(starts[1:] - ends[:-1] > rasterGap)[0] + 1
+        pieces = list(zip(numpy.split(starts, breaks), numpy.split(ends, breaks)))
+
+        # Start at the end of the row nearer to the head
+        forward = abs(head - starts[0]) <= abs(ends[-1] - head)
+
+        if forward:
+            head = ends[-1]
+        else:
+            pieces.reverse()
+            head = starts[0]
+
+        for pieceStarts, pieceEnds in pieces:
+            yield rasterLine(y, pieceStarts, pieceEnds, forward, pixel)
+
+    # Laser off, return to origin (0, 0) and end program with M2
+    yield "M5\n"
+    yield "G0X0Y0\n"
+    yield "M2\n"
+
+
+def edgeMask(mask):
+    '''
+    Return a boolean NumPy array which is True for every dark pixel that has
+    a light pixel (or the border of the image) directly next to it. This
+    checks all pixels at once instead of one at a time.
+
+    Arguments:
+        mask is of type ndarray. Contains the dark pixels, indexed [x, y].
+    '''
+
+    # Everything outside the image counts as light
+    padded = numpy.zeros((mask.shape[0] + 2, mask.shape[1] + 2), dtype=bool)
+    padded[1:-1, 1:-1] = mask
+
+    # A pixel is inside a shape if all four of its neighbours are dark
+    inside = padded[:-2, 1:-1] & padded[2:, 1:-1] & \
+             padded[1:-1, :-2] & padded[1:-1, 2:]
+
+    return mask & ~inside
+
+
+def nextPixelInShape(mask, px, direc):
+    '''
+    Return a tuple (coordinate, direction) which represents the next
+    coordinate when proceeding clockwise around a shape, and the direction
+    the tracer faces once it gets there. It is an implementation of the square
+    tracing algorithm, which works as follows:
         if on a black square, turn left of previous direction and go forward
         if on a white square, turn right of previous direction and go forward
 
     Arguments:
-        im is of type Image. Contains the image which is being processed.
-        px is of type tuple. Contains float elements (x, y) which represent the
+        mask is of type ndarray. Contains the dark pixels, indexed [x, y].
+        px is of type tuple. Contains int elements (x, y) which represent the
                              current coordinate.
+        direc is of type int. Direction the tracer is facing
+                              (0 = right, 1 = up, 2 = left, 3 = down).
     '''
 
-    global direc, done
-    
-    pixels = im.load()
+    width, height = mask.shape
+    x, y = px
 
-    try: pixel = pixel = sum(im.getpixel((px[0], px[1])))
-    except IndexError: pixel = sum((255, 255, 255))
+    # Since this function returns the next pixel, it can't return an off-shape
+    # white pixel. It keeps stepping until it lands on a black pixel.
+    while True:
+        if 0 <= x < width and 0 <= y < height and mask[x, y]:
+            direc = (direc - 1) % 4
+        else:
+            direc = (direc + 1) % 4
+
+        # Implementation of description in docstring
+        if direc == 0:
+            x += 1
+        elif direc == 1:
+            y += 1
+        elif direc == 2:
+            x -= 1
+        elif direc == 3:
+            y -= 1
+
+        if 0 <= x < width and 0 <= y < height and mask[x, y]:
+            return (x, y), direc
+
+
+def traceShapes(mask):
+    '''
+    Return a list of sublists of tuples which correspond to (x, y) coordinates,
+    one sublist for the outline of every shape in the mask. The image is
+    searched for the next shape column by column, like before, but every edge
+    pixel is looked at only once: a bitmap records which pixels were traced.
 
-    # 0 = right, 1 = up, 2 = left, 3 = down
-    if pixel < sum((127, 127, 127)):
-        direc = (direc - 1) % 4
-    else:
-        direc = (direc + 1) % 4
-
-    # Implementation of description in docstring
-    if direc == 0:
-        x = px[0] + 1
-        y = px[1]
-    elif direc == 1:
-        x = px[0]
-        y = px[1] + 1
-    elif direc == 2:
-        x = px[0] - 1
-        y = px[1]
-    elif direc == 3:
-        x = px[0]
-        y = px[1] - 1
-
-    try: pixel = sum(im.getpixel((x, y)))
-    except IndexError: pixel = sum((255, 255, 255))
+    Arguments:
+        mask is of type ndarray. Contains the dark pixels, indexed [x, y].
+    '''
 
-    # Since this function returns the next pixel, it can't return an off-shape
-    # white pixel. It recurses until it finds a black pixel, which it returns.
-    if pixel < sum((127, 127, 127)):
-        if (x, y) not in done:
-            done.append((x, y))
-        return (x, y)
-    else:
-        return nextPixelInShape(im, (x, y))
+    height = mask.shape[1]
+
+    # Record of all coordinates that were read from the image
+    done = numpy.zeros(mask.shape, dtype=bool)
+
+    # Edge pixels in the order they would be found scanning column by column
+    candidates = numpy.flatnonzero(edgeMask(mask))
+
+    # Square tracing can circle forever on some shapes, so cap the outline
+    limit = 4 * mask.size
+
+    direc = 0
+    shapeList = []
+
+    for index in candidates:
+        x, y = divmod(int(index), height)
+
+        if done[x, y]:
+            continue
+
+        start = (x, y)
+        done[x, y] = True
+        shape = [start]
+        point = start
 
+        # While it has not yet fully traced around the shape
+        while True:
+            point, direc = nextPixelInShape(mask, point, direc)
 
-def nextShape(im):
+            done[point] = True
+            shape.append(point)
+
+            if point == start or len(shape) > limit:
+                break
+
+        shapeList.append(shape)
+
+    return shapeList
+
+
+def labelComponents(mask):
     '''
-    Return a tuple which represents the leftmost point of the next shape.
+    Return a list of tuples (x, y, component), one for every connected group
+    of dark pixels (8-connected, diagonal neighbours belong together) in the
+    order their first pixel is found scanning column by column. component is
+    a boolean NumPy array holding only that group, its corner is at (x, y).
+
+    The mask is cut into runs of dark pixels along every column, all columns
+    at once. Runs that touch in neighbouring columns are joined with a
+    union-find, so the work is in runs, not in pixels.
 
     Arguments:
-        im is of type Image. Contains the image which is being processed.
+        mask is of type ndarray. Contains the dark pixels, indexed [x, y].
     '''
 
-    global imdim, done
-    
-    # Check the brightness of every point in the image
-    for x in range(imdim):
-        for y in range(imdim):
+    # Runs of every column, with a light pixel added at both ends
+    columns = numpy.zeros((mask.shape[0], mask.shape[1] + 2), dtype=numpy.int8)
+    columns[:, 1:-1] = mask
+    change = numpy.diff(columns, axis=1)
+    runX, runStart = numpy.nonzero(change == 1)
+    runEnd = numpy.nonzero(change == -1)[1]
+
+    # First run of every column, runs are in column order
+    first = numpy.searchsorted(runX, numpy.arange(mask.shape[0] + 1)).tolist()
+    start = runStart.tolist()
+    end = runEnd.tolist()
+
+    # Every group is known by its first run, the lowest index in it
+    parent = list(range(len(start)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    # Join the runs of every column with the ones they touch in the next
+    for x in range(mask.shape[0] - 1):
+        i, j = first[x], first[x + 1]
+        while i < first[x + 1] and j < first[x + 2]:
+            if start[j] <= end[i] and start[i] <= end[j]:
+                a, b = find(i), find(j)
+                if a != b:
+                    parent[max(a, b)] = min(a, b)
+
+            if end[i] < end[j]:
+                i += 1
+            else:
+                j += 1
+
+    # Number the groups by their first run, then collect the runs of each
+    roots = numpy.array([find(i) for i in range(len(start))], dtype=int)
+    _, group = numpy.unique(roots, return_inverse=True)
+    order = numpy.argsort(group, kind="stable")
+    bounds = numpy.flatnonzero(numpy.diff(group[order])) + 1
+
+    components = []
+    for runs in numpy.split(order, bounds):
+        if len(runs) == 0:
+            continue
+
+        xs, ys, ye = runX[runs], runStart[runs], runEnd[runs]
+        x0, y0 = int(xs.min()), int(ys.min())
+
+        component = numpy.zeros((int(xs.max()) + 1 - x0, int(ye.max()) - y0), dtype=bool)
+        for x, a, b in zip((xs - x0).tolist(), (ys - y0).tolist(), (ye - y0).tolist()):
+            component[x, a:b] = True
+
+        components.append((x0, y0, component))
+
+    return components
+
+
+def traceComponent(task):
+    '''
+    Return the traced and smoothed outlines of one group of dark pixels, each
+    closed and moved to where the group is in the image. This is the work
+    done for every group by the processes of the pool, so it only needs its
+    argument.
+
+    Arguments:
+        task is of type tuple. Contains (x, y, component) from labelComponents.
+    '''
+
+    x0, y0, component = task
+
+    shapeList = smoothRasterCoords(traceShapes(component))
+
+    # Ensure that each shape starts and ends on the same coordinate
+    for i in range(len(shapeList)):
+        if shapeList[i][-1] != shapeList[i][0]:
+            shapeList[i].append(shapeList[i][0])
+
+    return [[(x + x0, y + y0) for x, y in shape] for shape in shapeList]
+
+
+def traceComponents(components, processes = None):
+    '''
+    Return a list of sublists of tuples which correspond to (x, y) coordinates,
+    the outlines of all the groups of dark pixels. The groups are traced in
+    a pool of processes, and the outlines come back in the order of the
+    groups whatever process finishes first.
+
+    Arguments:
+        components is of type list. Contains the tuples from labelComponents.
+        processes is of type int. Size of the pool, one per core by default.
+    '''
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    # A pool is not worth starting for a handful of shapes
+    if processes <= 1 or len(components) < 2 * processes:
+        results = map(traceComponent, components)
+        return [shape for shapes in results for shape in shapes]
 
-            # If a dark pixel is found that was not already read, return it
-            if sum(im.getpixel((x, y))) < sum((127, 127, 127)) and\
-               isOnEdge(im, (x, y)) and not (x, y) in done:
-                done.append((x, y))
-                return(x, y)
+    # Hand out several groups at a time, most groups are small
+    chunk = max(1, len(components) // (4 * processes))
 
-    # If no shape is found, return a special tuple
-    return (-1, -1)
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = list(pool.imap(traceComponent, components, chunk))
+    finally:
+        pool.close()
+        pool.join()
+
+    return [shape for shapes in results for shape in shapes]
 
 
 def dist(a, b):
@@ -311,76 +816,511 @@ def dist(a, b):
     return ((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2) ** 0.5
 
 
-def linePointDist(m, b, p):
+def isClosed(shape):
     '''
-    Return the distance between a point and a line.
-    
+    Return whether the shape ends on the coordinate it starts from, so it can
+    be cut starting from any of its points.
+
     Arguments:
-        m, b are of type float. Represent slope and y-intercept of line.
-        p is of type tuple. Represents (x, y) coordinates.
+        shape is of type list. Contains (x, y) coordinates.
     '''
 
-    n = (m * p[0] - p[1] + b)
-    d = (m ** 2 + 1) ** 0.5
-    return abs(n / d)
+    return len(shape) > 2 and tuple(shape[0]) == tuple(shape[-1])
 
 
-def toFile(outfile, shapes):
+def startShapeAt(shape, k):
     '''
-    Print the coordinates to a text file formatted in G code.
-    
+    Return a copy of a closed shape which starts and ends on its point k.
+
+    Arguments:
+        shape is of type list. Contains (x, y) coordinates, the last one equal
+                               to the first.
+        k is of type int. Index of the new start point.
+    '''
+
+    if k == 0:
+        return list(shape)
+
+    body = list(shape[:-1])
+    return body[k:] + body[:k] + [body[k]]
+
+
+def travelDistance(shapes, origin = (0, 0)):
+    '''
+    Return the distance travelled with the cutter up: from the origin to the
+    first shape, between consecutive shapes, and from the last shape back to
+    the origin.
+
+    Arguments:
+        shapes is of type list. It contains sublists of (x, y) coordinates.
+        origin is of type tuple. Where the cutter starts and ends.
+    '''
+
+    total = 0
+    point = origin
+
+    for shape in shapes:
+        if len(shape) == 0:
+            continue
+        total += dist(point, shape[0])
+        point = shape[-1]
+
+    return total + dist(point, origin)
+
+
+def nearestNeighbourOrder(shapes, origin = (0, 0)):
+    '''
+    Return a list of shapes in the order a nearest neighbour search visits
+    them: from the current position, go to the closest point of any shape
+    that was not cut yet. Closed shapes can be entered at any of their
+    points, open shapes at either end. Points are kept in a grid of square
+    cells so only the cells around the current position are searched.
+
+    Arguments:
+        shapes is of type list. It contains sublists of (x, y) coordinates.
+        origin is of type tuple. Where the cutter starts.
+    '''
+
+    # Every point where a shape can be entered: (x, y, shape, point index)
+    entries = []
+    for s in range(len(shapes)):
+        shape = shapes[s]
+        if len(shape) == 0:
+            continue
+        if isClosed(shape):
+            for k in range(len(shape) - 1):
+                entries.append((shape[k][0], shape[k][1], s, k))
+        else:
+            entries.append((shape[0][0], shape[0][1], s, 0))
+            entries.append((shape[-1][0], shape[-1][1], s, len(shape) - 1))
+
+    if len(entries) == 0:
+        return list(shapes)
+
+    # Cell size so that there are about as many cells as points
+    xs = [e[0] for e in entries] + [origin[0]]
+    ys = [e[1] for e in entries] + [origin[1]]
+    minx = min(xs)
+    miny = min(ys)
+    size = max(max(xs) - minx, max(ys) - miny)
+    cell = max(size / len(entries) ** 0.5, 1e-9)
+    rings = int(size / cell) + 2
+
+    grid = {}
+    shapeCells = {}
+    for e in range(len(entries)):
+        key = (int((entries[e][0] - minx) / cell),
+               int((entries[e][1] - miny) / cell))
+        grid.setdefault(key, []).append(e)
+        shapeCells.setdefault(entries[e][2], set()).add(key)
+
+    ordered = []
+    point = origin
+
+    while shapeCells:
+        cx = int((point[0] - minx) / cell)
+        cy = int((point[1] - miny) / cell)
+
+        best = None
+        bestDist = float("inf")
+
+        # Search rings of cells around the current position. Once a point has
+        # been found, the next ring can only hold points further away than
+        # ring * cell, so the search stops there
+        for ring in range(rings + 1):
+            if bestDist <= (ring - 1) * cell:
+                break
+            for i in range(cx - ring, cx + ring + 1):
+                for j in range(cy - ring, cy + ring + 1):
+                    if max(abs(i - cx), abs(j - cy)) != ring:
+                        continue
+                    for e in grid.get((i, j), ()):
+                        d = dist(point, entries[e])
+                        if d < bestDist:
+                            best = e
+                            bestDist = d
+
+        s, k = entries[best][2], entries[best][3]
+        shape = shapes[s]
+
+        if isClosed(shape):
+            shape = startShapeAt(shape, k)
+        elif k != 0:
+            shape = shape[::-1]
+        ordered.append(shape)
+        point = shape[-1]
+
+        # Shape is done, take its points out of the grid
+        for key in shapeCells.pop(s):
+            grid[key] = [e for e in grid[key] if entries[e][2] != s]
+
+    return ordered
+
+
+def twoOptOrder(shapes, origin = (0, 0)):
+    '''
+    Return the shapes in an order improved with the 2-opt heuristic: a run of
+    shapes is cut in reverse whenever that shortens the travel. Shapes in a
+    reversed run are cut backwards, which for a closed shape changes nothing.
+
+    Arguments:
+        shapes is of type list. It contains sublists of (x, y) coordinates.
+        origin is of type tuple. Where the cutter starts and ends.
+    '''
+
+    shapes = [shape for shape in shapes if len(shape) > 0]
+    n = len(shapes)
+    if n < 3:
+        return shapes
+
+    # Entry and exit point of every stop, the origin before and after them
+    entry = numpy.array([origin] + [shape[0] for shape in shapes] + [origin],
+                        dtype=float)
+    exit = numpy.array([origin] + [shape[-1] for shape in shapes] + [origin],
+                       dtype=float)
+    order = list(range(n + 2))
+
+    improved = True
+    while improved:
+        improved = False
+
+        for i in range(n):
+            # Reversing stops i + 1 to j replaces the travel from exit i to
+            # entry i + 1 and from exit j to entry j + 1 with exit i to exit j
+            # and entry i + 1 to entry j + 1. Check every j at once
+            a = exit[i]
+            b = entry[i + 1]
+            c = exit[i + 2:n + 1]
+            d = entry[i + 3:n + 2]
+
+            gain = numpy.hypot(*(a - b)) + numpy.hypot(*(c - d).T) -\
+                   numpy.hypot(*(a - c).T) - numpy.hypot(*(b - d).T)
+
+            if len(gain) == 0:
+                continue
+            best = int(numpy.argmax(gain))
+            if gain[best] <= 1e-9:
+                continue
+
+            j = best + i + 2
+            # Reverse the run, entries and exits swap places
+            entry[i + 1:j + 1], exit[i + 1:j + 1] = \
+                exit[j:i:-1].copy(), entry[j:i:-1].copy()
+            order[i + 1:j + 1] = order[j:i:-1]
+            improved = True
+
+    # Rebuild the shapes, those in an odd number of reversed runs go backwards
+    ordered = []
+    for k in range(1, n + 1):
+        shape = shapes[order[k] - 1]
+        if tuple(entry[k]) != tuple(map(float, shape[0])):
+            shape = shape[::-1]
+        ordered.append(shape)
+
+    return ordered
+
+
+def orderShapes(shapes, origin = (0, 0)):
+    '''
+    Return the shapes in an order, and with start points, that keep the
+    travel between them short. A nearest neighbour tour is improved with
+    2-opt, then every closed shape is started at its point closest to where
+    the previous shape ended.
+
+    Arguments:
+        shapes is of type list. It contains sublists of (x, y) coordinates.
+        origin is of type tuple. Where the cutter starts and ends.
+    '''
+
+    ordered = twoOptOrder(nearestNeighbourOrder(shapes, origin), origin)
+
+    point = origin
+    for s in range(len(ordered)):
+        shape = ordered[s]
+        if isClosed(shape):
+            body = numpy.asarray(shape[:-1], dtype=float)
+            k = int(numpy.argmin(numpy.hypot(body[:, 0] - point[0],
+                                             body[:, 1] - point[1])))
+            ordered[s] = startShapeAt(shape, k)
+        point = ordered[s][-1]
+
+    return ordered
+
+
+def gcodeDecimals(step = resolution):
+    '''
+    Return the number of decimals coordinates are written with: the fewest
+    for which rounding stays within half a step of the machine.
+
+    Arguments:
+        step is of type float. Resolution of the machine in mm.
+    '''
+
+    return max(0, int(math.ceil(-math.log10(step / 2.0))))
+
+
+def gcodeNumber(units, decimals):
+    '''
+    Return the shortest text of a coordinate, "12.5" rather than "12.500",
+    "12" rather than "12." and ".5" rather than "0.5".
+
+    Arguments:
+        units is of type int. The coordinate in units of 10 ** -decimals mm.
+        decimals is of type int. Number of decimals the coordinate has.
+    '''
+
+    sign = "-" if units < 0 else ""
+    whole, fraction = divmod(abs(units), 10 ** decimals)
+
+    text = str(whole) if whole else ""
+    if fraction:
+        text += ("." + str(fraction).rjust(decimals, "0")).rstrip("0")
+
+    return sign + text if text else "0"
+
+
+def compactPoints(shape, decimals):
+    '''
+    Return the points of a shape rounded to whole units of 10 ** -decimals mm,
+    without repeated points and without the middle points of straight runs.
+    Points are only merged when they are exactly in line once rounded, so the
+    path that is cut stays the same.
+
+    Arguments:
+        shape is of type list. Contains (x, y) coordinates.
+        decimals is of type int. Number of decimals coordinates are written with.
+    '''
+
+    scale = 10 ** decimals
+    points = []
+
+    for coord in shape:
+        point = (int(round(coord[0] * scale)), int(round(coord[1] * scale)))
+
+        if points and point == points[-1]:
+            continue
+
+        # Drop the last point if it lies between the one before it and this one
+        if len(points) >= 2:
+            ax, ay = points[-2]
+            bx, by = points[-1]
+            if (bx - ax) * (point[1] - by) == (by - ay) * (point[0] - bx) and \
+               (bx - ax) * (point[0] - bx) + (by - ay) * (point[1] - by) > 0:
+                points.pop()
+
+        points.append(point)
+
+    return points
+
+
+def gcodeLines(shapes, decimals = None):
+    '''
+    Generate the lines of G code that cut the shapes, one at a time. Axis
+    words that have not changed since the last line are left out, and each
+    word is written without spaces or trailing zeros, as short as the G code
+    reader on the Pi accepts.
+
     Arguments:
         shapes is of type list. It contains sublists of tuples that correspond
                                 to (x, y) coordinates.
+        decimals is of type int. Number of decimals coordinates are written
+                                 with, from the machine resolution by default.
     '''
 
-    file = open(outfile, "w")
-    
+    if decimals is None:
+        decimals = gcodeDecimals()
+
     # Boilerplate text:
     # G17: Select X, Y plane
     # G21: Units in millimetres
     # G90: Absolute distances
     # G54: Coordinate system 1
-    file.write("G17 G21 G90 G54\n")
-    
+    yield "G17 G21 G90 G54\n"
+
     # Start at origin (0, 0)
-    file.write("G00 X0. Y0.\n")
+    yield "G0X0Y0\n"
+    last = (0, 0)
 
-    up = True
-    
     # Assume Z0 is down and cutting and Z1 is retracted up
     for shape in shapes:
-        for i in range(len(shape)):
-            # If coordinate is an integer, append a decimal point
-            if (shape[i][0] % 1.0 == 0): xstr = str(shape[i][0]) + "."
-            else: xstr = str(shape[i][0])
-            
-            if (shape[i][1] % 1.0 == 0): ystr = str(shape[i][1]) + "."
-            else: ystr = str(shape[i][1])
+        points = compactPoints(shape, decimals)
+
+        for i in range(len(points)):
+            x, y = points[i]
+            line = ""
 
-            # Write coordinate to file
-            file.write("X" + xstr + " Y" + ystr + "\n")
+            # Only the axes that move are written
+            if x != last[0]: line += "X" + gcodeNumber(x, decimals)
+            if y != last[1]: line += "Y" + gcodeNumber(y, decimals)
+            if line: yield line + "\n"
+            last = points[i]
 
             # When arrived at point of new shape, start cutting
-            if up == True:
-                file.write("Z0.\n")
-                up = False
+            if i == 0:
+                yield "Z0\n"
+
         # When finished shape, retract cutter
-        file.write("Z1.\n")
-        up = True
+        if points:
+            yield "Z1\n"
+
     # Return to origin (0, 0) when done, then end program with M2
-    file.write("X0. Y0.\nM2")
+    yield "X0Y0\n"
+    yield "M2\n"
+
+
+def toFile(outfile, shapes, compress = False):
+    '''
+    Print the coordinates to a text file formatted in G code.
+    
+    Arguments:
+        shapes is of type list. It contains sublists of tuples that correspond
+                                to (x, y) coordinates.
+        compress is of type bool. True to write a gzip file.
+    '''
+
+    return linesToFile(outfile, gcodeLines(shapes), compress)
+
+
+def linesToFile(outfile, lines, compress = False):
+    '''
+    Print lines of G code to a text file, through a large write buffer.
+    Return the name of the file written, with ".gz" added when compressed.
+
+    Arguments:
+        lines is an iterable of strings. Each one ends with a newline.
+        compress is of type bool. True to write a gzip file.
+    '''
+
+    if compress:
+        outfile += ".gz"
+        file = io.BufferedWriter(gzip.open(outfile, "wb"), writeBuffer)
+    else:
+        file = open(outfile, "wb", writeBuffer)
 
-    file.close()
+    try:
+        for line in lines:
+            file.write(line.encode())
+    finally:
+        file.close()
 
+    return outfile
 
-def toSerial(shapes):
+
+def serialLines(shapes):
+    '''
+    Generate the lines of G code that are sent through serial, one at a time.
+    They are the same lines that are printed to file.
+
+    Arguments:
+        shapes is of type list. It contains sublists of tuples that correspond
+                                to (x, y) coordinates.
+    '''
+
+    return gcodeLines(shapes)
+
+
+def streamLines(port, lines, bufferSize):
+    '''
+    Send lines through serial as fast as the receiver can take them and return
+    a tuple (lines sent, seconds taken), or None if the link went down (or the
+    receiver stopped answering for ackTimeout). The receiver acknowledges
+    every line it has taken out of its buffer ("ok" or "error"), so the bytes
+    sent but not yet acknowledged are known. A line is sent as soon as it fits
+    in the receiver's buffer next to them, which keeps the link busy without
+    overrunning the buffer.
+
+    Arguments:
+        port is of type Serial. Contains the open serial connection.
+        lines is an iterable of strings. Each one ends with a newline.
+        bufferSize is of type int. Size of the receive buffer in bytes.
+    '''
+
+    # Lengths of the lines sent but not yet acknowledged, oldest first
+    inFlight = collections.deque()
+    pending = 0
+    sent = 0
+
+    start = time.time()
+
+    for line in lines:
+        data = line.encode()
+
+        # Wait until the line fits in the receiver's buffer
+        while inFlight and pending + len(data) > bufferSize:
+            if not readAck(port):
+                return None
+            pending -= inFlight.popleft()
+
+        port.write(data)
+        inFlight.append(len(data))
+        pending += len(data)
+        sent += 1
+
+    # Wait until everything has been taken in
+    while inFlight:
+        if not readAck(port):
+            return None
+        inFlight.popleft()
+
+    return (sent, time.time() - start)
+
+
+def readAck(port, timeout = ackTimeout):
+    '''
+    Return True once the receiver has acknowledged a line, False if the link
+    went down or the receiver did not answer within timeout. The receiver
+    only acknowledges a line once it has run it, which takes as long as the
+    machine is busy with the moves before it, so by default there is no limit.
+
+    Arguments:
+        port is of type Serial. Contains the open serial connection, its
+                                timeout is how often the link is checked.
+        timeout is of type float. Seconds to wait, None to wait for as long as
+                                  the link is up.
+    '''
+
+    start = time.time()
+
+    while True:
+        try:
+            reply = port.readline()
+        except serial.SerialException:
+            return False
+
+        if len(reply) == 0:
+            # Nothing yet, the receiver is still busy
+            if timeout is not None and time.time() - start >= timeout:
+                return False
+            continue
+
+        # Anything that is not an acknowledgement is just a message
+        reply = reply.strip().lower()
+        if reply.startswith(b"ok") or reply.startswith(b"error"):
+            return True
+
+
+def toSerial(shapes, baud = baudrate, bufferSize = rxBuffer):
     '''
     Send the coordinates formatted in G code through serial to Arduino.
     
     Arguments:
         shapes is of type list. It contains sublists of tuples that correspond
                                 to (x, y) coordinates.
+        baud is of type int. Speed of the serial link in bits per second.
+        bufferSize is of type int. Size of the receive buffer on the other end.
+    '''
+
+    return linesToSerial(serialLines(shapes), baud, bufferSize)
+
+
+def linesToSerial(lines, baud = baudrate, bufferSize = rxBuffer):
+    '''
+    Send lines of G code through serial to Arduino.
+
+    Arguments:
+        lines is an iterable of strings. Each one ends with a newline.
+        baud is of type int. Speed of the serial link in bits per second.
+        bufferSize is of type int. Size of the receive buffer on the other end.
     '''
 
     # First, search COM ports for a connected Arduino
@@ -390,7 +1330,7 @@ def toSerial(shapes):
 
     for tempport in portlist:
         if tempport[1].startswith("Arduino"):
-            port = serial.Serial(tempport[0])
+            port = serial.Serial(tempport[0], baud, timeout = ackPoll)
             found = True
 
     # If no Arduino is found, return False
@@ -401,47 +1341,18 @@ def toSerial(shapes):
     # Arduino restarts when serial is initialized, so wait until it's ready
     time.sleep(5)
 
-    port.baudrate = 4800
+    # Stream the lines, the receiver tells us when there is room for more
+    result = streamLines(port, lines, bufferSize)
 
-    # Boilerplate text:
-    # G17: Select X, Y plane
-    # G21: Units in millimetres
-    # G90: Absolute distances
-    # G54: Coordinate system 1
-    port.write("G17 G21 G90 G54\n".encode())
-
-    # Start at origin (0, 0)
-    port.write("G00 X0. Y0.\n".encode())
-
-    up = True
-    
-    # Assume Z0 is down and cutting and Z1 is retracted up
-    for shape in shapes:
-        for i in range(len(shape)):
-            # Since the RAM on the Arduino is limited, delay the instructions
-            time.sleep(1)
-
-            # If coordinate is an integer, append a decimal point
-            if (shape[i][0] % 1.0 == 0): xstr = str(shape[i][0]) + "."
-            else: xstr = str(shape[i][0])
-            
-            if (shape[i][1] % 1.0 == 0): ystr = str(shape[i][1]) + "."
-            else: ystr = str(shape[i][1])
-
-            # Write coordinate to serial
-            port.write(("X" + xstr + " Y" + ystr + "\n").encode())
+    port.close()
 
-            # When arrived at point of new shape, start cutting
-            if up == True:
-                port.write(("Z0.\n").encode())
-                up = False
-        # When finished shape, retract cutter
-        port.write("Z1.\n".encode())
-        up = True
-    # Return to origin (0, 0) when done, then end program with M2
-    port.write("X0. Y0.\nM2".encode())
+    if result is None:
+        print("Lost the serial device!")
+        return False
 
-    port.close()
+    sent, seconds = result
+    print("%d lines in %.1f s (%.1f lines/s)..." %
+          (sent, seconds, sent / max(seconds, 1e-9)), end = "")
 
     # Once sending is completed, return True
     return True
@@ -457,50 +1368,41 @@ def readFromRaster(filename):
         filename is of type string. Contains name of image file.
     '''
 
-    global done
-
-    # Create Image object from file in local folder
-    im = initRaster(filename)
+    # Mask of the dark pixels of the image file in local folder
+    mask, pixel = rasterMask(filename)
 
     print("Done!\nReading coordinate path...", end = "")
 
-    # Find first point
-    point = nextShape(im)
+    # Split the mask into groups of touching dark pixels
+    components = labelComponents(mask)
 
-    start = point
-    nextpoint = (0, 0)
-    
-    i = 0
-    shapeList = []
+    # Trace and smooth the outline of every group, in parallel
+    print("Done! %d shapes\nTracing and smoothing coordinates..." % len(components), end = "")
+    shapeList = traceComponents(components, traceProcesses)
 
-    # While there are still shapes in the image
-    while point != (-1, -1):
-        start = point
-        
-        shapeList.append([])
-        shapeList[i].append(point)
+    # Pixels to mm
+    if pixel != 1.0:
+        shapeList = [[(x * pixel, y * pixel) for x, y in shape] for shape in shapeList]
 
-        # While it has not yet fully traced around the image
-        while nextpoint != start:
-            nextpoint = nextPixelInShape(im, point)
-            point = nextpoint
+    return shapeList
 
-            done.append(point)
-            shapeList[i].append(point)
 
-        i += 1
-        point = nextShape(im)
-    
-    # Smooth coordinates in image
-    print("Done!\nSmoothing coordinates...", end = "")
-    shapeList = smoothRasterCoords(shapeList)
-    
-    # Ensure that each shape starts and ends on the same coordinate
-    for i in range(len(shapeList)):
-        if shapeList[i][-1] != shapeList[i][0]:
-            shapeList[i].append(shapeList[i][0])
+def fillFromRaster(filename):
+    '''
+    Return a list of the lines of G code that fill the dark areas of a raster
+    image with scanlines, instead of tracing their outlines.
 
-    return shapeList
+    Arguments:
+        filename is of type string. Contains name of image file.
+    '''
+
+    # Mask of the dark pixels of the image file in local folder
+    mask, pixel = rasterMask(filename)
+
+    print("Done!\nFinding scanlines...", end = "")
+    spans = rasterSpans(mask)
+
+    return list(fillLines(spans, pixel))
 
 
 def readFromDXF(filename):
@@ -512,50 +1414,20 @@ def readFromDXF(filename):
         filename is of type string. Contains name of image file.
     '''
 
-    # Create Image object from file in local folder
-    DXFtxt = initDXF(filename)
-    
     print("Done!\nReading coordinate path...", end = "")
 
-    segment = -1
-
     path = []
-    xold = []
-    yold = []
-
-    line = 0
-    polyline = 0
-    vertex = 0
-
-    # While there is still more to read
-    while line < len(DXFtxt):
-        # These are just conditions how to interpret the DXF into coordinates
-        if (DXFtxt[line] == "POLYLINE\n"):
-            segment += 1
-            polyline = 1
-            path.append([])
-
-        elif (DXFtxt[line] == "VERTEX\n"):
-            vertex = 1
-
-        elif ((DXFtxt[line].strip() == "10") & (vertex == 1) & (polyline == 1)):
-            line += 1
-            x = float(DXFtxt[line])
-
-        elif ((DXFtxt[line].strip() == "20") & (vertex == 1) & (polyline == 1)):
-            line += 1
-            y = float(DXFtxt[line])
 
-            if ((x != xold) | (y != yold)):
-                path[segment].append([float(x),float(y)])
-                xold = x
-                yold = y
+    # Read the shapes as the file is scanned, dropping repeated points
+    for shape in dxfShapes(filename):
+        points = []
 
-        elif (DXFtxt[line] == "SEQEND\n"):
-            polyline = 0
-            vertex = 0
+        for point in shape:
+            if not points or point != points[-1]:
+                points.append(point)
 
-        line += 1
+        if points:
+            path.append(points)
 
     # Rescale the coordinates to imdim x imdim
     scale(path)
@@ -579,20 +1451,37 @@ if __name__ == "__main__":
         except FileNotFoundError:
             print("File not found")
 
-    # Read the image as raster or as DXF depending on file extension
+    # Raster images can be filled with scanlines instead of traced
+    fill = False
     if filename.endswith((".jpg", ".jpeg", ".png", ".bmp")):
+        fill = input("Fill dark areas instead of tracing outlines? (y/n) ").lower().startswith("y")
+
+    # Read the image as raster or as DXF depending on file extension
+    if fill:
         print("Reading raster image...", end = "")
-        coords = readFromRaster(filename)
-    elif filename.endswith(".dxf"):
-        print("Reading dxf file...", end = "")
-        coords = readFromDXF(filename)
-        
+        lines = fillFromRaster(filename)
+        print("Done!")
+    else:
+        if filename.endswith((".jpg", ".jpeg", ".png", ".bmp")):
+            print("Reading raster image...", end = "")
+            coords = readFromRaster(filename)
+        elif filename.endswith(".dxf"):
+            print("Reading dxf file...", end = "")
+            coords = readFromDXF(filename)
+
+        # Cut the shapes in an order that keeps the travel between them short
+        print("Done!\nOrdering shapes...", end = "")
+        before = travelDistance(coords)
+        coords = orderShapes(coords)
+        print("Done! Travel %.1f -> %.1f" % (before, travelDistance(coords)))
+        lines = list(serialLines(coords))
+
     # Create new output file with same name as input file
     outfile = filename.rsplit(".", 1)[0] + ".gcode"
     
     # After reading the coordinates, send them to a text file and to serial
-    print("Done!\nPrinting to file...", end = "")    
-    toFile(outfile, coords)
+    print("Printing to file...", end = "")    
+    outfile = linesToFile(outfile, lines, gzipOutput)
     print("Done!\nSending to serial...", end = "")    
-    i = toSerial(coords)
+    i = linesToSerial(lines)
     if i == True: print("Done!")
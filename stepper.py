@@ -5,14 +5,14 @@
 # Import required libraries
 import sys
 import time
-import RPi.GPIO as GPIO
+import GPIO_Backend
 from numpy import sqrt
  
 #-----------------------------#
 # Define Classes to be called #
 #-----------------------------#
 
-class Stepper:
+class Stepper(object):
   '''
   This class will drive bipolar stepper motors
 
@@ -61,7 +61,7 @@ class Stepper:
   # Variable to keep tabs on the current driving state
   driving_seq_pos = 0
 
-  def __init__(self,StepPins):
+  def __init__(self,StepPins,gpio=None):
     '''
     This is the Initialization function for the class
 
@@ -71,46 +71,47 @@ class Stepper:
     SquFLP is for full step, low current driving, energize only one phase when stepping
 
     User may be permitted to pick their driving sequence based on the task required
+
+    gpio is the GPIO backend, the one from GPIO_Backend.get_backend() by default
     '''
     super(Stepper, self).__init__()
 
+    if gpio is None:
+      gpio = GPIO_Backend.get_backend()
+    self.gpio = gpio
+    self.StepPins = tuple(StepPins)
+
     # Use BCM GPIO references
     # instead of physical pin numbers
-    GPIO.setmode(GPIO.BCM)
+    gpio.setmode(gpio.BCM)
 
     # Set all pins as output
     for pin in StepPins:
-      print "Setup pins"
-      GPIO.setup(pin,GPIO.OUT)
-      GPIO.output(pin, False)
+      print("Setup pins")
+      gpio.setup(pin,gpio.OUT)
+      gpio.output(pin, False)
 
-    step_seq_size = len(self.Seq)-1
+    self.step_seq_size = len(self.Seq)-1
  
-  def step(step_distance):
-     
-    for i in range(0,abs(step_distance))
-      # If we reach the end of the sequence
-      # start again
-      if (StepCounter>=len(Seq)):
-        StepCounter = 0
-      elif (StepCounter<0):
-        StepCounter = len(Seq)-1
-
-      if(step_distance > 0): # If stepping forward
-        StepCounter++
-      if(step_distance < 0): # If stepping back
-        StepCounter--
-
-      #write operation to pins
-      for pin in range(0, 4):
-        xpin = StepPins[pin]
-        if self.Seq[StepCounter][pin]!=0:
-          GPIO.output(xpin, True)
-        else:
-          GPIO.output(xpin, False)
+  def step(self,step_distance):
+    ''' Step the motor by step_distance steps, the sign gives the direction
+
+    step(step_distance)
+    '''
+    if(step_distance > 0): # If stepping forward
+      direction = 1
+    else: # If stepping back
+      direction = -1
+
+    for i in range(0,abs(step_distance)):
+      # Going past either end of the sequence starts it again
+      self.driving_seq_pos = (self.driving_seq_pos + direction) % len(self.Seq)
+
+      #write operation to pins, all four in one call
+      self.gpio.output(self.StepPins, self.Seq[self.driving_seq_pos])
 
       # Wait apporiate wait time
-      time.sleep(STEP_WAIT_TIME)
+      time.sleep(self.STEP_WAIT_TIME/1000.0)
 
   def setRPM(new_rpm):
     ''' This function sets the speed of which the stepper is driven